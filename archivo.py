@@ -0,0 +1,109 @@
+"""Cierre de eventos: archivo de solicitudes y resumen.
+
+Al cerrar un evento sus solicitudes y votos pasan de las tablas vivas a
+solicitudes_archivo / votos_archivo, y se guarda un resumen (totales y
+canciones mas votadas) en resumen_eventos, calculado una sola vez. Las
+tablas vivas, que la cola y los votantes cargan enteras en memoria al
+arrancar, quedan solo con los eventos en curso.
+
+Las funciones reciben una conexion con la transaccion ya abierta.
+"""
+import json
+import os
+
+# Canciones que se guardan en el resumen de un evento
+ARCHIVO_TOP = int(os.getenv("ARCHIVO_TOP", "10"))
+
+COLUMNAS = ("id", "evento_id", "cancion", "artista", "spotify_id", "portada_url", "dedicatoria",
+            "votos", "estado", "tipo", "ip_solicitante", "creado_en")
+# Configuracion que hereda un evento nuevo del anterior
+COLUMNAS_CONFIG = ("subtitle", "logo_url", "cashapp", "venmo", "applepay", "love_text",
+                   "instagram", "tiktok", "facebook", "spotify_dj", "website")
+
+async def resumir(conn, evento_id: int) -> dict:
+    cursor = await conn.execute("""
+        SELECT
+            SUM(COALESCE(tipo,'cancion') != 'mensaje'),
+            SUM(tipo = 'mensaje'),
+            SUM(estado = 'reproducida'),
+            SUM(estado = 'rechazada'),
+            SUM(CASE WHEN COALESCE(tipo,'cancion') != 'mensaje' THEN votos ELSE 0 END)
+        FROM solicitudes WHERE evento_id=?
+    """, (evento_id,))
+    canciones, mensajes, reproducidas, rechazadas, votos = [n or 0 for n in await cursor.fetchone()]
+    cursor = await conn.execute(
+        "SELECT COUNT(DISTINCT v.ip_votante) FROM votos v JOIN solicitudes s ON s.id = v.solicitud_id WHERE s.evento_id=?",
+        (evento_id,)
+    )
+    votantes = (await cursor.fetchone())[0]
+    cursor = await conn.execute("""
+        SELECT cancion, artista, spotify_id, votos, estado FROM solicitudes
+        WHERE evento_id=? AND COALESCE(tipo,'cancion') != 'mensaje'
+        ORDER BY votos DESC, id LIMIT ?
+    """, (evento_id, ARCHIVO_TOP))
+    top = [dict(r) for r in await cursor.fetchall()]
+    return {"canciones": canciones, "mensajes": mensajes, "reproducidas": reproducidas,
+            "rechazadas": rechazadas, "votos": votos, "votantes": votantes, "top": top}
+
+async def archivar(conn, evento_id: int) -> int:
+    """Mueve las solicitudes del evento y sus votos al archivo. Devuelve cuantas."""
+    await conn.execute("""
+        INSERT INTO votos_archivo (id, solicitud_id, ip_votante, creado_en)
+        SELECT v.id, v.solicitud_id, v.ip_votante, v.creado_en
+        FROM votos v JOIN solicitudes s ON s.id = v.solicitud_id WHERE s.evento_id=?
+    """, (evento_id,))
+    await conn.execute("DELETE FROM votos WHERE solicitud_id IN (SELECT id FROM solicitudes WHERE evento_id=?)",
+                       (evento_id,))
+    columnas = ", ".join(COLUMNAS)
+    await conn.execute(f"INSERT INTO solicitudes_archivo ({columnas}) SELECT {columnas} FROM solicitudes WHERE evento_id=?",
+                       (evento_id,))
+    cursor = await conn.execute("DELETE FROM solicitudes WHERE evento_id=?", (evento_id,))
+    return cursor.rowcount
+
+async def crear(conn, nombre: str, copiar_de: int | None = None) -> int:
+    """Evento nuevo y activo. Con `copiar_de` hereda la configuracion
+    (redes, propinas, logo) de ese evento."""
+    cursor = await conn.execute("INSERT INTO eventos (nombre) VALUES (?) RETURNING id", (nombre,))
+    evento_id = (await cursor.fetchone())[0]
+    if copiar_de is not None:
+        columnas = ", ".join(COLUMNAS_CONFIG)
+        await conn.execute(
+            f"INSERT INTO configuracion (evento_id, event_name, {columnas}) "
+            f"SELECT ?, ?, {columnas} FROM configuracion WHERE evento_id=?",
+            (evento_id, nombre, copiar_de)
+        )
+    return evento_id
+
+async def activos(conn) -> list[int]:
+    cursor = await conn.execute("SELECT id FROM eventos WHERE activo=1 ORDER BY id")
+    return [r[0] for r in await cursor.fetchall()]
+
+async def cerrar(conn, evento_id: int) -> dict:
+    """Cierra un evento activo: resumen, archivo y activo=0."""
+    cursor = await conn.execute(
+        "UPDATE eventos SET activo=0, cerrado_en=CURRENT_TIMESTAMP WHERE id=? AND activo=1", (evento_id,)
+    )
+    if cursor.rowcount == 0:
+        raise ValueError("El evento no existe o ya esta cerrado")
+    resumen = await resumir(conn, evento_id)
+    await conn.execute("""
+        INSERT OR REPLACE INTO resumen_eventos (evento_id, canciones, mensajes, reproducidas, rechazadas, votos, votantes, top)
+        VALUES (?,?,?,?,?,?,?,?)
+    """, (evento_id, resumen["canciones"], resumen["mensajes"], resumen["reproducidas"], resumen["rechazadas"],
+          resumen["votos"], resumen["votantes"], json.dumps(resumen["top"], ensure_ascii=False)))
+    archivadas = await archivar(conn, evento_id)
+    return {"evento_id": evento_id, "archivadas": archivadas, "resumen": resumen}
+
+async def listar(conn) -> list[dict]:
+    """Todos los eventos, con el resumen de los cerrados."""
+    cursor = await conn.execute("""
+        SELECT e.*, r.canciones, r.mensajes, r.reproducidas, r.rechazadas, r.votos, r.votantes, r.top
+        FROM eventos e LEFT JOIN resumen_eventos r ON r.evento_id = e.id
+        ORDER BY e.id
+    """)
+    eventos = []
+    for r in await cursor.fetchall():
+        e = dict(r)
+        e["top"] = json.loads(e["top"]) if e["top"] else None
+        eventos.append(e)
+    return eventos
@@ -0,0 +1,102 @@
+"""Backup de la base en streaming.
+
+Las exportaciones JSON/NDJSON leen todas las tablas dentro de una misma
+transaccion de lectura (en WAL es una foto consistente que no bloquea al
+escritor) y se envian por partes de BACKUP_CHUNK filas. El formato `db` copia
+la base con la API de backup de SQLite a un archivo temporal, en un solo paso
+(un backup por pasos vuelve a empezar cada vez que otra conexion escribe, y
+con el evento en curso no terminaria nunca), y lo envia por bloques. En
+ningun caso se arma el backup completo en memoria.
+"""
+import aiosqlite
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import zlib
+
+from database import DB_PATH
+
+BACKUP_CHUNK = int(os.getenv("BACKUP_CHUNK", "500"))
+BLOQUE = 64 * 1024
+
+TABLAS = ["eventos", "solicitudes", "configuracion", "votos",
+          "solicitudes_archivo", "votos_archivo", "resumen_eventos"]
+FORMATOS = {"json": "application/json", "ndjson": "application/x-ndjson", "db": "application/vnd.sqlite3"}
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, default=str)
+
+async def _filas(path: str = DB_PATH):
+    """(tabla, [filas]) por partes, todo dentro de una transaccion de lectura."""
+    # Conexion propia: una descarga larga no ocupa un lector del pool
+    conn = await aiosqlite.connect(f"file:{path}?mode=ro", uri=True)
+    conn.row_factory = aiosqlite.Row
+    try:
+        await conn.execute("BEGIN")
+        for tabla in TABLAS:
+            cursor = await conn.execute(f"SELECT * FROM {tabla} ORDER BY rowid")
+            yield tabla, None
+            while rows := await cursor.fetchmany(BACKUP_CHUNK):
+                yield tabla, [dict(r) for r in rows]
+        await conn.rollback()
+    finally:
+        await conn.close()
+
+async def exportar_json(path: str = DB_PATH):
+    """Mismo formato que el backup anterior: {"tabla": [filas], ...}."""
+    primera_tabla = True
+    async for tabla, filas in _filas(path):
+        if filas is None:
+            yield ("{" if primera_tabla else "],") + f"\n{_dumps(tabla)}: [\n"
+            primera_tabla, primera_fila = False, True
+            continue
+        texto = ",\n".join(_dumps(f) for f in filas)
+        yield texto if primera_fila else ",\n" + texto
+        primera_fila = False
+    yield "{}\n" if primera_tabla else "]\n}\n"
+
+async def exportar_ndjson(path: str = DB_PATH):
+    """Una linea por fila: {"tabla": ..., "fila": {...}}."""
+    async for tabla, filas in _filas(path):
+        if filas:
+            yield "".join(_dumps({"tabla": tabla, "fila": f}) + "\n" for f in filas)
+
+def _copiar(origen: str, destino: str):
+    src = sqlite3.connect(f"file:{origen}?mode=ro", uri=True)
+    dst = sqlite3.connect(destino)
+    try:
+        # Un solo paso dentro de una transaccion de lectura: en WAL no
+        # bloquea al escritor y no se reinicia por sus commits
+        src.backup(dst, pages=-1)
+    finally:
+        dst.close()
+        src.close()
+
+async def exportar_db(path: str = DB_PATH):
+    """Copia consistente del archivo .db (API de backup) enviada por bloques."""
+    fd, tmp = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        await asyncio.to_thread(_copiar, path, tmp)
+        with open(tmp, "rb") as f:
+            while bloque := await asyncio.to_thread(f.read, BLOQUE):
+                yield bloque
+    finally:
+        os.unlink(tmp)
+
+async def comprimir(partes):
+    """gzip en streaming sobre un generador de str/bytes."""
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for parte in partes:
+        datos = z.compress(parte.encode() if isinstance(parte, str) else parte)
+        if datos:
+            yield datos
+    yield z.flush()
+
+def exportar(formato: str, gzip: bool = False, path: str = DB_PATH):
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato no soportado: {formato}")
+    partes = {"json": exportar_json, "ndjson": exportar_ndjson, "db": exportar_db}[formato](path)
+    return comprimir(partes) if gzip else partes
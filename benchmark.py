@@ -0,0 +1,391 @@
+"""Benchmark de carga: invitados pidiendo, votando y escuchando broadcasts.
+
+Uso:
+    python benchmark.py [--phones 200] [--rounds 10] [--listeners 30]
+    python benchmark.py --url http://localhost:8000
+    python benchmark.py --out resultados.json --baseline anterior.json
+
+Sin --url levanta la app en este proceso (uvicorn en 127.0.0.1, puerto
+libre) contra una base temporal, con la busqueda yendo por ITunesBackend a un
+iTunes falso local (itunes_falso.py, --itunes-ms de latencia, sin red). Con --url mide un servidor ya corriendo;
+ese servidor necesita TRUST_PROXY=1 para que cada telefono vote con su IP, y
+la busqueda usa el backend que tenga configurado.
+
+Cada telefono simulado busca, pide una cancion, escucha su /ws/usuario/{id},
+vota y consulta /api/cola en rondas. Un DJ simulado aprueba solicitudes y
+--listeners sockets escuchan /ws/dj, /ws/display y /ws/cola/1. Se reporta
+req/s y p50/p99 por endpoint y el retraso de entrega de cada broadcast
+(desde que sale el POST hasta que llega al socket). Los votos al panel se
+agrupan cada VOTE_COALESCE_MS, asi que su retraso lo incluye.
+
+--out guarda los resultados en JSON; --baseline compara contra un JSON
+anterior y termina con codigo 1 si algo empeoro mas que --tolerancia.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import httpx
+import websockets
+
+from itunes_falso import ITunesFalso
+
+QUERIES = ["bad bunny", "shakira", "karol g", "daddy yankee", "queen", "dua lipa",
+           "marc anthony", "romeo santos", "the weeknd", "selena", "maluma", "abba"]
+
+CONEXIONES_POR_POOL = 8
+
+COLA_SQL = "SELECT * FROM solicitudes WHERE evento_id=? AND estado!='rechazada' ORDER BY votos DESC, id ASC"
+
+# ─── Mediciones ───────────────────────────────────────────────────────
+def percentiles(valores: list[float]) -> dict:
+    if not valores:
+        return {"n": 0}
+    valores = sorted(valores)
+    pct = lambda p: valores[min(len(valores) - 1, int(len(valores) * p))] * 1000
+    return {"n": len(valores), "p50_ms": round(pct(0.50), 2), "p99_ms": round(pct(0.99), 2),
+            "max_ms": round(valores[-1] * 1000, 2)}
+
+class Metricas:
+    def __init__(self):
+        self.latencias: dict[str, list[float]] = defaultdict(list)
+        self.status: dict[str, Counter] = defaultdict(Counter)
+        # Momento en que salio el POST que origina cada broadcast
+        self.origen: dict[tuple, float] = {}
+        # (canal, clave, momento de llegada)
+        self.llegadas: list[tuple[str, tuple, float]] = []
+
+    async def http(self, nombre: str, peticion) -> httpx.Response | None:
+        t0 = time.perf_counter()
+        try:
+            r = await peticion
+        except Exception as e:
+            self.status[nombre][type(e).__name__] += 1
+            return None
+        self.latencias[nombre].append(time.perf_counter() - t0)
+        self.status[nombre][str(r.status_code)] += 1
+        return r
+
+# ─── Sockets ──────────────────────────────────────────────────────────
+async def escuchar(ws_url: str, canal: str, m: Metricas, listo: asyncio.Event | None = None,
+                   solicitud_id: int | None = None):
+    try:
+        async with websockets.connect(ws_url, max_size=None) as ws:
+            if listo is not None:
+                listo.set()
+            async for texto in ws:
+                t = time.perf_counter()
+                msg = json.loads(texto)
+                tipo = msg.get("tipo")
+                if tipo == "nueva_solicitud":
+                    m.llegadas.append((canal, ("nueva", msg["id"]), t))
+                elif tipo == "voto":
+                    m.llegadas.append((canal, ("voto", msg["id"], msg["votos"]), t))
+                elif tipo == "cola_delta" and msg.get("op") == "nueva":
+                    m.llegadas.append((canal, ("nueva", msg["row"]["id"]), t))
+                elif canal == "usuario" and tipo == "aprobada":
+                    m.llegadas.append((canal, ("estado", solicitud_id), t))
+    except (asyncio.CancelledError, websockets.ConnectionClosed, OSError):
+        if listo is not None:
+            listo.set()
+
+# ─── Escenario ────────────────────────────────────────────────────────
+async def escenario(args, base: str) -> dict:
+    m = Metricas()
+    ws_base = "ws" + base[len("http"):]
+    rnd_dj = random.Random(args.semilla)
+    ids: list[int] = []
+    sockets: list[asyncio.Task] = []
+    n_por_canal = Counter()
+
+    # Varios pools chicos en vez de uno grande: el pool de httpcore recorre
+    # todas sus conexiones en cada request y con cientos se vuelve el cuello
+    # de botella del propio benchmark.
+    n_pools = max(1, args.concurrency // CONEXIONES_POR_POOL)
+    limites = httpx.Limits(max_connections=CONEXIONES_POR_POOL, max_keepalive_connections=CONEXIONES_POR_POOL)
+    pools = [httpx.AsyncClient(base_url=base, limits=limites, timeout=30) for _ in range(n_pools)]
+    client = pools[0]
+    try:
+        canales = [("dj", "/ws/dj"), ("display", "/ws/display"), ("cola", "/ws/cola/1")]
+        listos = []
+        for i in range(args.listeners):
+            canal, ruta = canales[i % len(canales)]
+            listo = asyncio.Event()
+            listos.append(listo)
+            n_por_canal[canal] += 1
+            sockets.append(asyncio.create_task(escuchar(ws_base + ruta, canal, m, listo)))
+        await asyncio.gather(*(l.wait() for l in listos))
+
+        async def telefono(i: int):
+            rnd = random.Random(args.semilla + i)
+            client = pools[i % n_pools]
+            headers = {"x-forwarded-for": f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"}
+            await asyncio.sleep(rnd.uniform(0, args.think_ms / 1000))
+            for ronda in range(args.rounds):
+                if rnd.random() < args.p_buscar:
+                    await m.http("GET /api/buscar", client.get("/api/buscar", headers=headers,
+                                                                 params={"q": rnd.choice(QUERIES)}))
+                if ronda == 0 or rnd.random() < args.p_solicitar:
+                    t0 = time.perf_counter()
+                    r = await m.http("POST /api/solicitar", client.post("/api/solicitar", headers=headers, json={
+                        "evento_id": 1, "cancion": f"Cancion {i}-{ronda}", "artista": "Bench",
+                        "spotify_id": f"bench-{i}-{ronda}", "dedicatoria": "",
+                    }))
+                    if r is not None and r.status_code == 200:
+                        sid = r.json()["id"]
+                        m.origen[("nueva", sid)] = t0
+                        ids.append(sid)
+                        if args.usuario:
+                            n_por_canal["usuario"] += 1
+                            sockets.append(asyncio.create_task(
+                                escuchar(f"{ws_base}/ws/usuario/{sid}", "usuario", m, solicitud_id=sid)))
+                if ids:
+                    sid = rnd.choice(ids)
+                    t0 = time.perf_counter()
+                    r = await m.http("POST /api/votar/{id}", client.post(f"/api/votar/{sid}", headers=headers))
+                    if r is not None and r.status_code == 200:
+                        m.origen.setdefault(("voto", sid, r.json()["votos"]), t0)
+                await m.http("GET /api/cola/{evento_id}", client.get("/api/cola/1", headers=headers))
+                await asyncio.sleep(rnd.uniform(0, args.think_ms / 1000))
+
+        async def dj():
+            aprobadas = set()
+            while True:
+                await asyncio.sleep(args.dj_ms / 1000)
+                pendientes = [i for i in ids if i not in aprobadas]
+                if not pendientes:
+                    continue
+                sid = rnd_dj.choice(pendientes)
+                aprobadas.add(sid)
+                t0 = time.perf_counter()
+                await m.http("POST /api/dj/estado/{id}", client.post(
+                    f"/api/dj/estado/{sid}", json={"password": args.password, "estado": "aprobada"}))
+                m.origen[("estado", sid)] = t0
+
+        t0 = time.perf_counter()
+        dj_task = asyncio.create_task(dj())
+        await asyncio.gather(*(telefono(i) for i in range(args.phones)))
+        duracion = time.perf_counter() - t0
+        dj_task.cancel()
+        # Dejar llegar los ultimos broadcasts (los votos van agrupados)
+        await asyncio.sleep(args.drain)
+        for t in sockets:
+            t.cancel()
+        await asyncio.gather(*sockets, dj_task, return_exceptions=True)
+    finally:
+        for pool in pools:
+            await pool.aclose()
+
+    http = {}
+    for nombre, lat in sorted(m.latencias.items()):
+        http[nombre] = {**percentiles(lat), "rps": round(len(lat) / duracion, 1), "status": dict(m.status[nombre])}
+    for nombre, status in m.status.items():
+        http.setdefault(nombre, {"n": 0, "status": dict(status)})
+
+    lags = defaultdict(list)
+    for canal, clave, t in m.llegadas:
+        if clave in m.origen:
+            lags[(canal, clave[0])].append(t - m.origen[clave])
+    broadcast = {}
+    nuevas = sum(1 for k in m.origen if k[0] == "nueva")
+    aprobadas = sum(1 for k in m.origen if k[0] == "estado")
+    esperados = {("dj", "nueva"): nuevas * n_por_canal["dj"],
+                 ("display", "nueva"): nuevas * n_por_canal["display"],
+                 ("cola", "nueva"): nuevas * n_por_canal["cola"],
+                 ("usuario", "estado"): aprobadas}
+    for (canal, tipo), lat in sorted(lags.items()):
+        broadcast[f"{canal}:{tipo}"] = percentiles(lat)
+    for (canal, tipo), n in esperados.items():
+        fila = broadcast.setdefault(f"{canal}:{tipo}", {"n": 0})
+        fila["perdidos"] = max(0, n - fila["n"])
+
+    total = sum(len(lat) for lat in m.latencias.values())
+    return {"http": http, "broadcast": broadcast,
+            "total": {"duracion_s": round(duracion, 2), "requests": total, "rps": round(total / duracion, 1)}}
+
+# ─── Antes / despues: capa de conexiones ──────────────────────────────
+async def bench_conexiones(n: int, concurrency: int) -> dict:
+    import aiosqlite
+    import database
+
+    async def correr(fn):
+        lat = []
+        sem = asyncio.Semaphore(concurrency)
+
+        async def una():
+            async with sem:
+                t0 = time.perf_counter()
+                await fn()
+                lat.append(time.perf_counter() - t0)
+        await asyncio.gather(*(una() for _ in range(n)))
+        return lat
+
+    async def antes():
+        async with aiosqlite.connect(database.DB_PATH) as conn:
+            conn.row_factory = aiosqlite.Row
+            cursor = await conn.execute(COLA_SQL, (1,))
+            await cursor.fetchall()
+
+    async def despues():
+        async with database.db.read() as conn:
+            cursor = await conn.execute(COLA_SQL, (1,))
+            await cursor.fetchall()
+
+    return {"antes: connect por request": percentiles(await correr(antes)),
+            "despues: pool de lectores": percentiles(await correr(despues))}
+
+# ─── Servidor en proceso ──────────────────────────────────────────────
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def en_proceso(args) -> dict:
+    tmp = tempfile.mkdtemp(prefix="djbench_")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+    os.environ["BUS_PATH"] = os.path.join(tmp, "bus.db")
+    os.environ["TRUST_PROXY"] = "1"
+    os.environ["DJ_PASSWORD"] = args.password
+    import uvicorn
+    import database
+    import main
+    import spotify
+    from queue_state import colas
+
+    falso = ITunesFalso(args.itunes_ms)
+    await falso.start()
+    spotify.servicio.backend = spotify.ITunesBackend(falso.url)
+    puerto = puerto_libre()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=puerto,
+                                           log_level="warning", ws_max_size=2**24))
+    servidor = asyncio.create_task(server.serve())
+    while not server.started:
+        if servidor.done():
+            servidor.result()
+        await asyncio.sleep(0.05)
+    try:
+        # Cola con historia realista antes de medir
+        async with database.db.write() as conn:
+            await conn.executemany(
+                "INSERT INTO solicitudes (evento_id, cancion, artista, votos) VALUES (1,?,?,?)",
+                [(f"Seed {i}", "Seed", i % 17) for i in range(args.seed)]
+            )
+        await colas.load()
+        resultados = await escenario(args, f"http://127.0.0.1:{puerto}")
+        resultados["itunes_falso"] = {"llamadas": falso.llamadas,
+                                     "cache_hits": spotify.servicio.hits, "cache_misses": spotify.servicio.misses}
+        if args.conexiones:
+            resultados["conexiones"] = await bench_conexiones(args.phones * args.rounds, args.concurrency)
+    finally:
+        server.should_exit = True
+        await servidor
+        await falso.stop()
+    return resultados
+
+# ─── Reporte ──────────────────────────────────────────────────────────
+def imprimir(res: dict):
+    print("HTTP:")
+    for nombre, r in res["http"].items():
+        errores = sum(n for s, n in r["status"].items() if not s.isdigit() or int(s) >= 500)
+        if r["n"]:
+            print(f"  {nombre:<28} {r['rps']:>8.0f} req/s   p50 {r['p50_ms']:7.2f} ms   "
+                  f"p99 {r['p99_ms']:7.2f} ms   {r['status']}" + (f"   ERRORES {errores}" if errores else ""))
+        else:
+            print(f"  {nombre:<28} sin respuestas   {r['status']}")
+    t = res["total"]
+    print(f"  {'total':<28} {t['rps']:>8.0f} req/s   {t['requests']} requests en {t['duracion_s']} s")
+    print("Broadcasts (retraso de entrega):")
+    for nombre, r in res["broadcast"].items():
+        perdidos = f"   perdidos {r['perdidos']}" if r.get("perdidos") else ""
+        if r["n"]:
+            print(f"  {nombre:<28} {r['n']:>8} msgs    p50 {r['p50_ms']:7.2f} ms   p99 {r['p99_ms']:7.2f} ms{perdidos}")
+        else:
+            print(f"  {nombre:<28} sin mensajes{perdidos}")
+    if "conexiones" in res:
+        print("Capa de conexiones (consulta de cola):")
+        for nombre, r in res["conexiones"].items():
+            print(f"  {nombre:<28} p50 {r['p50_ms']:7.2f} ms   p99 {r['p99_ms']:7.2f} ms")
+
+def comparar(res: dict, baseline: dict, tolerancia: float) -> list[str]:
+    """Metricas que empeoraron mas que `tolerancia` respecto del baseline."""
+    regresiones = []
+    for seccion, claves in (("http", ("p99_ms", "rps")), ("broadcast", ("p99_ms",))):
+        for nombre, actual in res[seccion].items():
+            anterior = baseline.get(seccion, {}).get(nombre)
+            if not anterior:
+                continue
+            for clave in claves:
+                a, b = anterior.get(clave), actual.get(clave)
+                if not a or b is None:
+                    continue
+                cambio = (b - a) / a
+                peor = cambio < -tolerancia if clave == "rps" else cambio > tolerancia
+                print(f"  {seccion}/{nombre} {clave}: {a} -> {b} ({cambio:+.0%})" + ("   REGRESION" if peor else ""))
+                if peor:
+                    regresiones.append(f"{seccion}/{nombre} {clave}")
+    return regresiones
+
+def commit_actual() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+async def run(args) -> int:
+    res = await (escenario(args, args.url.rstrip("/")) if args.url else en_proceso(args))
+    res = {
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit_actual(),
+        "modo": args.url or "en proceso",
+        "python": sys.version.split()[0],
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "password")},
+        **res,
+    }
+    imprimir(res)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(res, f, indent=2, ensure_ascii=False)
+        print(f"Resultados en {args.out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"Contra {args.baseline} ({baseline.get('commit')}, {baseline.get('fecha')}):")
+        regresiones = comparar(res, baseline, args.tolerancia)
+        if regresiones:
+            print(f"{len(regresiones)} regresiones")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="servidor ya corriendo (default: app en este proceso)")
+    parser.add_argument("--phones", type=int, default=200, help="telefonos simulados")
+    parser.add_argument("--rounds", type=int, default=10, help="rondas por telefono")
+    parser.add_argument("--listeners", type=int, default=30, help="sockets en /ws/dj, /ws/display y /ws/cola/1")
+    parser.add_argument("--no-usuario", dest="usuario", action="store_false",
+                        help="no abrir /ws/usuario/{id} por solicitud")
+    parser.add_argument("--concurrency", type=int, default=100, help="conexiones HTTP maximas")
+    parser.add_argument("--think-ms", type=float, default=50, help="pausa maxima entre acciones")
+    parser.add_argument("--p-buscar", type=float, default=0.5)
+    parser.add_argument("--p-solicitar", type=float, default=0.1, help="despues de la primera ronda")
+    parser.add_argument("--dj-ms", type=float, default=100, help="cada cuanto aprueba el DJ")
+    parser.add_argument("--itunes-ms", type=float, default=150, help="latencia del iTunes falso")
+    parser.add_argument("--seed", type=int, default=200, help="solicitudes precargadas en la cola")
+    parser.add_argument("--semilla", type=int, default=1, help="semilla aleatoria")
+    parser.add_argument("--drain", type=float, default=1.0, help="segundos para los ultimos broadcasts")
+    parser.add_argument("--password", default=os.getenv("DJ_PASSWORD", "dj1234"))
+    parser.add_argument("--conexiones", action="store_true", help="comparar connect por request vs pool")
+    parser.add_argument("--out", help="guardar resultados en JSON")
+    parser.add_argument("--baseline", help="JSON de una corrida anterior para comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.2)
+    sys.exit(asyncio.run(run(parser.parse_args())))
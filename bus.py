@@ -0,0 +1,134 @@
+"""Bus de mensajes entre workers para ConnectionManager.
+
+Con `uvicorn --workers N` cada proceso tiene sus propios sockets. Todo
+broadcast se publica en un canal ("dj", "display", "usuario:<id>",
+"cola:<evento_id>"); cada worker entrega a sus sockets locales.
+
+BUS_BACKEND:
+    local   un solo proceso (default), entrega directa en memoria
+    sqlite  varios workers en la misma maquina; los mensajes pasan por una
+            tabla en BUS_PATH que cada worker lee cada BUS_POLL_MS
+"""
+import aiosqlite
+import asyncio
+import json
+import logging
+import os
+import secrets
+import time
+
+from metricas import ERRORES_FONDO
+
+BUS_BACKEND = os.getenv("BUS_BACKEND", "local")
+BUS_PATH = os.getenv("BUS_PATH", "bus.db")
+BUS_POLL_MS = int(os.getenv("BUS_POLL_MS", "20"))
+# Segundos que se guardan los mensajes antes de borrarlos
+BUS_RETENCION = float(os.getenv("BUS_RETENCION", "60"))
+
+# Identifica a este proceso dentro del bus
+ORIGEN = f"{os.getpid()}-{secrets.token_hex(3)}"
+
+log = logging.getLogger(__name__)
+
+class InProcessBus:
+    """Entrega directa: lo que se publica llega solo a este proceso."""
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    async def start(self):
+        pass
+
+    async def publish(self, canal: str, message: dict):
+        await self.handler(canal, message, False)
+
+    async def stop(self):
+        pass
+
+class SqliteBus:
+    """Bus entre procesos sobre una tabla SQLite compartida.
+
+    El que publica entrega a sus sockets en el momento y deja el mensaje en
+    la tabla; los demas workers lo leen en su siguiente poll. El id
+    autoincremental da un orden global.
+    """
+
+    def __init__(self, handler, path: str = BUS_PATH, poll_ms: int = BUS_POLL_MS):
+        self.handler = handler
+        self.path = path
+        self.poll = poll_ms / 1000
+        self._conn: aiosqlite.Connection | None = None
+        self._task: asyncio.Task | None = None
+        self._ultimo = 0
+
+    async def start(self):
+        self._conn = await aiosqlite.connect(self.path, isolation_level=None)
+        await self._conn.execute("PRAGMA journal_mode=WAL")
+        await self._conn.execute("PRAGMA synchronous=NORMAL")
+        await self._conn.execute("PRAGMA busy_timeout=5000")
+        await self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS bus (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                origen TEXT NOT NULL,
+                canal TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                creado REAL NOT NULL
+            )
+        """)
+        cursor = await self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM bus")
+        self._ultimo = (await cursor.fetchone())[0]
+        self._task = asyncio.create_task(self._loop())
+
+    async def publish(self, canal: str, message: dict):
+        await self.handler(canal, message, False)
+        await self._conn.execute(
+            "INSERT INTO bus (origen, canal, payload, creado) VALUES (?,?,?,?)",
+            (ORIGEN, canal, json.dumps(message, ensure_ascii=False), time.time())
+        )
+
+    async def _loop(self):
+        ultima_limpieza = time.monotonic()
+        fallos = 0
+        while True:
+            await asyncio.sleep(self.poll)
+            try:
+                cursor = await self._conn.execute(
+                    "SELECT id, origen, canal, payload FROM bus WHERE id > ? ORDER BY id LIMIT 1000",
+                    (self._ultimo,)
+                )
+                for id_, origen, canal, payload in await cursor.fetchall():
+                    self._ultimo = id_
+                    if origen != ORIGEN:
+                        await self.handler(canal, json.loads(payload), True)
+                if time.monotonic() - ultima_limpieza > BUS_RETENCION / 4:
+                    ultima_limpieza = time.monotonic()
+                    await self._conn.execute("DELETE FROM bus WHERE creado < ?", (time.time() - BUS_RETENCION,))
+            except Exception:
+                # Se reintenta en el proximo poll; el log solo al empezar y
+                # al terminar la racha de errores, el conteo en /metrics
+                ERRORES_FONDO.inc("bus")
+                fallos += 1
+                if fallos == 1:
+                    log.exception("error leyendo mensajes del bus")
+                continue
+            if fallos:
+                log.warning("bus recuperado despues de %d errores seguidos", fallos)
+                fallos = 0
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+def crear_bus(handler, nombre: str = BUS_BACKEND):
+    """handler(canal, message, remoto) entrega un mensaje a los sockets locales."""
+    if nombre == "sqlite":
+        return SqliteBus(handler)
+    return InProcessBus(handler)
@@ -0,0 +1,242 @@
+"""Catalogo local de canciones para buscar sin internet.
+
+Guarda las canciones en su propio archivo SQLite con un indice FTS5
+(tokenizer trigram), asi que la busqueda mientras se escribe encuentra
+subcadenas ("bunn" -> "Bad Bunny") y tolera errores de tipeo.
+
+Importar:
+    python catalogo.py importar canciones.csv
+    python catalogo.py importar canciones.json
+    python catalogo.py solicitudes            # desde el historial de dj_request.db
+"""
+import aiosqlite
+import asyncio
+import csv
+import json
+import os
+import sys
+
+CATALOG_PATH = os.getenv("CATALOG_PATH", "catalogo.db")
+
+# Nombres de columna aceptados en los dumps CSV/JSON (incluye formato iTunes)
+ALIAS = {
+    "spotify_id": ["spotify_id", "trackId", "id"],
+    "cancion": ["cancion", "trackName", "title", "name", "song"],
+    "artista": ["artista", "artistName", "artist"],
+    "album": ["album", "collectionName"],
+    "portada_url": ["portada_url", "artworkUrl100", "cover", "artwork"],
+    "preview_url": ["preview_url", "previewUrl"],
+    "duracion_ms": ["duracion_ms", "trackTimeMillis", "duration_ms"],
+    "popularidad": ["popularidad", "popularity", "plays"],
+}
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS canciones (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        spotify_id TEXT NOT NULL UNIQUE,
+        cancion TEXT NOT NULL,
+        artista TEXT NOT NULL,
+        album TEXT DEFAULT '',
+        portada_url TEXT DEFAULT '',
+        preview_url TEXT,
+        duracion_ms INTEGER DEFAULT 0,
+        popularidad INTEGER DEFAULT 0
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS canciones_fts USING fts5(
+        cancion, artista, album,
+        content='canciones', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS canciones_ai AFTER INSERT ON canciones BEGIN
+        INSERT INTO canciones_fts(rowid, cancion, artista, album) VALUES (new.id, new.cancion, new.artista, new.album);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS canciones_ad AFTER DELETE ON canciones BEGIN
+        INSERT INTO canciones_fts(canciones_fts, rowid, cancion, artista, album) VALUES ('delete', old.id, old.cancion, old.artista, old.album);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS canciones_au AFTER UPDATE OF cancion, artista, album ON canciones BEGIN
+        INSERT INTO canciones_fts(canciones_fts, rowid, cancion, artista, album) VALUES ('delete', old.id, old.cancion, old.artista, old.album);
+        INSERT INTO canciones_fts(rowid, cancion, artista, album) VALUES (new.id, new.cancion, new.artista, new.album);
+    END
+    """,
+]
+
+UPSERT = """
+    INSERT INTO canciones (spotify_id, cancion, artista, album, portada_url, preview_url, duracion_ms, popularidad)
+    VALUES (:spotify_id, :cancion, :artista, :album, :portada_url, :preview_url, :duracion_ms, :popularidad)
+    ON CONFLICT(spotify_id) DO UPDATE SET
+        cancion=excluded.cancion, artista=excluded.artista,
+        album=CASE WHEN excluded.album != '' THEN excluded.album ELSE album END,
+        portada_url=CASE WHEN excluded.portada_url != '' THEN excluded.portada_url ELSE portada_url END,
+        preview_url=COALESCE(excluded.preview_url, preview_url),
+        duracion_ms=MAX(excluded.duracion_ms, duracion_ms),
+        popularidad=MAX(excluded.popularidad, popularidad)
+"""
+
+COLUMNAS = "spotify_id, cancion, artista, album, portada_url, preview_url, duracion_ms"
+
+def _campo(raw: dict, campo: str, default=None):
+    for alias in ALIAS[campo]:
+        if raw.get(alias) not in (None, ""):
+            return raw[alias]
+    return default
+
+def normalizar_cancion(raw: dict) -> dict | None:
+    """Convierte una fila de cualquier dump soportado al formato del catalogo."""
+    cancion = _campo(raw, "cancion")
+    artista = _campo(raw, "artista")
+    if not cancion or not artista:
+        return None
+    spotify_id = _campo(raw, "spotify_id")
+    if not spotify_id:
+        # Sin id externo: clave estable a partir del titulo y el artista
+        spotify_id = "local:" + " ".join(f"{cancion}|{artista}".casefold().split())
+    portada = _campo(raw, "portada_url", "")
+    return {
+        "spotify_id": str(spotify_id),
+        "cancion": str(cancion),
+        "artista": str(artista),
+        "album": str(_campo(raw, "album", "")),
+        "portada_url": portada.replace("100x100", "300x300"),
+        "preview_url": _campo(raw, "preview_url"),
+        "duracion_ms": int(_campo(raw, "duracion_ms", 0) or 0),
+        "popularidad": int(_campo(raw, "popularidad", 0) or 0),
+    }
+
+def _fts_frase(texto: str) -> str:
+    return '"' + texto.replace('"', '""') + '"'
+
+def _fts_trigramas(texto: str, maximo: int = 24) -> str:
+    # OR de los trigramas de la consulta: bm25 premia a los que comparten
+    # mas trigramas, lo que da una busqueda aproximada tolerante a typos.
+    grams = []
+    for i in range(len(texto) - 2):
+        g = texto[i:i + 3]
+        if g.strip() and g not in grams:
+            grams.append(g)
+    return " OR ".join(_fts_frase(g) for g in grams[:maximo])
+
+# ─── Backend de busqueda ──────────────────────────────────────────────
+class CatalogBackend:
+    """Backend local para SearchService; misma interfaz que ITunesBackend."""
+
+    def __init__(self, path: str = CATALOG_PATH):
+        self.path = path
+        self._conn: aiosqlite.Connection | None = None
+        self._lock = asyncio.Lock()
+
+    async def conn(self) -> aiosqlite.Connection:
+        async with self._lock:
+            if self._conn is None:
+                conn = await aiosqlite.connect(self.path)
+                conn.row_factory = aiosqlite.Row
+                await conn.execute("PRAGMA journal_mode=WAL")
+                await conn.execute("PRAGMA synchronous=NORMAL")
+                for sql in SCHEMA:
+                    await conn.execute(sql)
+                await conn.commit()
+                self._conn = conn
+        return self._conn
+
+    async def buscar(self, query: str, limit: int) -> list:
+        conn = await self.conn()
+        query = " ".join(query.split())
+        if len(query) < 3:
+            # El tokenizer trigram necesita 3+ caracteres: prefijo simple
+            cursor = await conn.execute(
+                f"SELECT {COLUMNAS} FROM canciones WHERE cancion LIKE ?1 OR artista LIKE ?1 "
+                "ORDER BY popularidad DESC LIMIT ?2",
+                (query + "%", limit)
+            )
+            return [dict(r) for r in await cursor.fetchall()]
+
+        sql = (
+            f"SELECT {', '.join('c.' + c.strip() for c in COLUMNAS.split(','))} "
+            "FROM canciones_fts JOIN canciones c ON c.id = canciones_fts.rowid "
+            "WHERE canciones_fts MATCH ? "
+            "ORDER BY bm25(canciones_fts, 10.0, 5.0, 1.0) - 0.5 * MIN(c.popularidad, 20) LIMIT ?"
+        )
+        cursor = await conn.execute(sql, (_fts_frase(query), limit))
+        resultados = [dict(r) for r in await cursor.fetchall()]
+        if len(resultados) < limit:
+            vistos = {r["spotify_id"] for r in resultados}
+            cursor = await conn.execute(sql, (_fts_trigramas(query.casefold()), limit * 2))
+            for r in await cursor.fetchall():
+                if r["spotify_id"] not in vistos and len(resultados) < limit:
+                    resultados.append(dict(r))
+        return resultados
+
+    async def guardar(self, canciones: list[dict]) -> int:
+        """Inserta o actualiza canciones en cualquier formato soportado. Devuelve cuantas."""
+        filas = [c for c in (normalizar_cancion(c) for c in canciones) if c]
+        if not filas:
+            return 0
+        conn = await self.conn()
+        await conn.executemany(UPSERT, filas)
+        await conn.commit()
+        return len(filas)
+
+    async def aclose(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+# ─── Importacion ──────────────────────────────────────────────────────
+def leer_dump(path: str) -> list[dict]:
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get("results") or data.get("canciones") or []
+        return data
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return list(csv.DictReader(f))
+
+async def importar_archivo(backend: CatalogBackend, path: str) -> int:
+    return await backend.guardar(leer_dump(path))
+
+async def importar_solicitudes(backend: CatalogBackend, db_path: str) -> int:
+    """Carga las canciones pedidas en eventos anteriores; popularidad = veces pedida."""
+    async with aiosqlite.connect(db_path) as db:
+        db.row_factory = aiosqlite.Row
+        # Los eventos cerrados estan en solicitudes_archivo (ver archivo.py)
+        cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE name='solicitudes_archivo'")
+        tabla = "solicitudes"
+        if await cursor.fetchone():
+            columnas = "spotify_id, cancion, artista, portada_url, votos, tipo"
+            tabla = f"(SELECT {columnas} FROM solicitudes UNION ALL SELECT {columnas} FROM solicitudes_archivo)"
+        cursor = await db.execute(f"""
+            SELECT spotify_id, cancion, artista, MAX(portada_url) AS portada_url,
+                   COUNT(*) + SUM(votos) AS popularidad
+            FROM {tabla}
+            WHERE COALESCE(tipo, 'cancion') = 'cancion'
+            GROUP BY COALESCE(NULLIF(spotify_id, ''), lower(cancion) || '|' || lower(artista))
+        """)
+        rows = [dict(r) for r in await cursor.fetchall()]
+    return await backend.guardar(rows)
+
+if __name__ == "__main__":
+    from database import DB_PATH
+
+    async def _main(args):
+        backend = CatalogBackend()
+        try:
+            if len(args) == 2 and args[0] == "importar":
+                n = await importar_archivo(backend, args[1])
+            elif len(args) == 1 and args[0] == "solicitudes":
+                n = await importar_solicitudes(backend, DB_PATH)
+            else:
+                print(__doc__)
+                return
+            print(f"{n} canciones importadas en {backend.path}")
+        finally:
+            await backend.aclose()
+
+    asyncio.run(_main(sys.argv[1:]))
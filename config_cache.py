@@ -0,0 +1,63 @@
+import hashlib
+import json
+
+from database import db
+
+CONFIG_DEFAULT = {"event_name": "Mi Evento", "subtitle": "DJ Request System", "logo_url": "", "cashapp": "", "venmo": "", "applepay": "", "love_text": "Show Your Love 💛", "instagram": "", "tiktok": "", "facebook": "", "spotify_dj": "", "website": ""}
+CONFIG_PUBLICA_DEFAULT = {"event_name": "DJ Request", "subtitle": "groovtek.com — DJ Request System", "logo_url": "", "love_text": "Show Your Love 💛"}
+
+class ConfigCache:
+    """Configuracion y eventos activos en memoria, versionados.
+
+    Se cargan al arrancar y se recargan enteros cuando el DJ guarda la
+    configuracion (o cambia un evento). La version es un hash del contenido,
+    asi que todos los workers generan el mismo ETag para los mismos datos.
+    Las paginas HTML se renderizan una vez por version.
+    """
+
+    def __init__(self):
+        self.configs: dict[int, dict] = {}
+        self.publica: dict = CONFIG_PUBLICA_DEFAULT
+        self.eventos_activos: list[dict] = []
+        self.version = ""
+        self._paginas: dict[str, tuple[str, str]] = {}  # nombre -> (etag, html)
+
+    @property
+    def etag(self) -> str:
+        return f'"cfg-{self.version}"'
+
+    async def reload(self):
+        async with db.read() as conn:
+            cursor = await conn.execute("SELECT * FROM configuracion ORDER BY id")
+            configs = [dict(r) for r in await cursor.fetchall()]
+            cursor = await conn.execute("SELECT * FROM eventos WHERE activo=1 ORDER BY id")
+            eventos = [dict(r) for r in await cursor.fetchall()]
+        contenido = json.dumps([configs, eventos], sort_keys=True, default=str)
+        # Todo se reemplaza junto, sin awaits en el medio
+        self.configs = {c["evento_id"]: c for c in configs}
+        # La publica es la del evento actual (o la primera guardada)
+        actual = self.configs.get(eventos[-1]["id"]) if eventos else None
+        self.publica = actual or (configs[0] if configs else CONFIG_PUBLICA_DEFAULT)
+        self.eventos_activos = eventos
+        self.version = hashlib.sha1(contenido.encode()).hexdigest()[:16]
+        self._paginas = {}
+
+    def config(self, evento_id: int) -> dict:
+        return self.configs.get(evento_id) or {"evento_id": evento_id, **CONFIG_DEFAULT}
+
+    def evento_actual(self) -> dict | None:
+        """Ultimo evento activo (el que usan el panel y el display)."""
+        return self.eventos_activos[-1] if self.eventos_activos else None
+
+    def pagina(self, nombre: str, render) -> tuple[str, str]:
+        """(etag, html) de `nombre` para la version actual; llama a `render()`
+        solo la primera vez. El ETag sale del HTML, asi cambia tambien si se
+        despliega una plantilla nueva."""
+        cached = self._paginas.get(nombre)
+        if cached is None:
+            html = render()
+            cached = ('"' + hashlib.sha1(html.encode()).hexdigest()[:20] + '"', html)
+            self._paginas[nombre] = cached
+        return cached
+
+config_cache = ConfigCache()
@@ -0,0 +1,233 @@
+from fastapi import WebSocket
+import asyncio
+import inspect
+import json
+import os
+import time
+
+from bus import crear_bus
+from metricas import FANOUT_DURACION, FANOUT_SOCKETS, SOCKETS_DESCARTADOS
+
+# Tiempo maximo para entregar un mensaje a un socket antes de cortarlo
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "2"))
+# Mensajes pendientes por socket antes de aplicar la politica de lentos
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+# disconnect: cerrar el socket lento | drop: descartar el mensaje nuevo
+WS_SLOW_POLICY = os.getenv("WS_SLOW_POLICY", "disconnect")
+
+def dumps(message: dict) -> str:
+    # Mismo formato que WebSocket.send_json
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+# ─── Buzon de salida por socket ───────────────────────────────────────
+class Outbox:
+    """Cola acotada de mensajes ya serializados + tarea que los envia en orden.
+
+    Un telefono lento solo llena su propia cola; nunca bloquea a los demas
+    destinatarios ni al handler HTTP que origino el broadcast.
+    """
+
+    def __init__(self, ws: WebSocket):
+        self.ws = ws
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+        self.alive = True
+        self.dropped = 0
+        self.task = asyncio.create_task(self._run())
+
+    def push(self, text: str) -> bool:
+        """Encola sin esperar. Devuelve False si el socket quedo descartado."""
+        if not self.alive:
+            return False
+        try:
+            self.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if WS_SLOW_POLICY != "drop":
+                SOCKETS_DESCARTADOS.inc("lento_cerrado")
+                self.close()
+                return False
+            SOCKETS_DESCARTADOS.inc("lento_mensaje")
+        return True
+
+    async def _run(self):
+        try:
+            while True:
+                text = await self.queue.get()
+                await asyncio.wait_for(self.ws.send_text(text), WS_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            SOCKETS_DESCARTADOS.inc("timeout" if isinstance(e, asyncio.TimeoutError) else "error_envio")
+            self.alive = False
+            try:
+                await asyncio.wait_for(self.ws.close(), WS_SEND_TIMEOUT)
+            except Exception:
+                pass
+
+    def close(self):
+        # Cerrar el socket hace que el loop receive_text del endpoint falle
+        # y llame a disconnect_*, que termina de limpiar.
+        self.alive = False
+        self.task.cancel()
+        asyncio.create_task(self._close_ws())
+
+    async def _close_ws(self):
+        try:
+            await asyncio.wait_for(self.ws.close(code=1013), WS_SEND_TIMEOUT)
+        except Exception:
+            pass
+
+# ─── WebSocket Manager ────────────────────────────────────────────────
+class ConnectionManager:
+    """Sockets de este proceso. Los broadcasts se publican en el bus (ver
+    bus.py) y cada worker los entrega a sus propios sockets en `_entregar`.
+    """
+
+    def __init__(self):
+        self.dj_connections: list[WebSocket] = []
+        self.user_connections: dict[int, list[WebSocket]] = {}
+        self.display_connections: list[WebSocket] = []
+        self.cola_connections: dict[int, list[WebSocket]] = {}
+        self.outboxes: dict[WebSocket, Outbox] = {}
+        self.bus = crear_bus(self._entregar)
+        # tipo de canal -> fn(message) que aplica un mensaje de otro worker al
+        # estado local y devuelve lo que hay que entregar (o None). Puede ser
+        # async si hay que recargar algo antes de entregar.
+        self.replicadores: dict[str, callable] = {}
+
+    async def start(self):
+        await self.bus.start()
+
+    async def stop(self):
+        await self.bus.stop()
+
+    async def _entregar(self, canal: str, message: dict, remoto: bool):
+        tipo, _, clave = canal.partition(":")
+        if remoto and tipo in self.replicadores:
+            message = self.replicadores[tipo](message)
+            if inspect.isawaitable(message):
+                message = await message
+            if message is None:
+                return
+        t0 = time.perf_counter()
+        n = self._entregar_local(tipo, clave, message)
+        FANOUT_DURACION.observar(time.perf_counter() - t0, tipo)
+        FANOUT_SOCKETS.inc(tipo, n=n)
+
+    def _entregar_local(self, tipo: str, clave: str, message: dict) -> int:
+        if tipo == "dj":
+            # Tambien notificar a displays
+            return self._fanout(self.dj_connections, message) + self._fanout(self.display_connections, message)
+        if tipo == "display":
+            return self._fanout(self.display_connections, message)
+        if tipo == "usuario":
+            return self._fanout(self.user_connections.get(int(clave), []), message)
+        if tipo == "cola":
+            return self._fanout(self.cola_connections.get(int(clave), []), message)
+        return 0
+
+    async def _accept(self, ws: WebSocket):
+        await ws.accept()
+        self.outboxes[ws] = Outbox(ws)
+
+    def _release(self, ws: WebSocket):
+        outbox = self.outboxes.pop(ws, None)
+        if outbox is not None:
+            outbox.alive = False
+            outbox.task.cancel()
+
+    def _fanout(self, conns: list[WebSocket], message: dict) -> int:
+        """Serializa una sola vez y encola para todos; no espera entregas.
+        Devuelve a cuantos sockets se encolo."""
+        if not conns:
+            return 0
+        text = dumps(message)
+        dead = []
+        for ws in conns:
+            outbox = self.outboxes.get(ws)
+            if outbox is None or not outbox.push(text):
+                dead.append(ws)
+        for ws in dead:
+            try: conns.remove(ws)
+            except: pass
+        return len(conns)
+
+    def conteos(self) -> dict[str, int]:
+        """Sockets conectados en este proceso por canal."""
+        return {
+            "dj": len(self.dj_connections),
+            "display": len(self.display_connections),
+            "usuario": sum(len(c) for c in self.user_connections.values()),
+            "cola": sum(len(c) for c in self.cola_connections.values()),
+        }
+
+    def send(self, ws: WebSocket, message: dict):
+        outbox = self.outboxes.get(ws)
+        if outbox is not None:
+            outbox.push(dumps(message))
+
+    async def connect_dj(self, ws: WebSocket):
+        await self._accept(ws)
+        self.dj_connections.append(ws)
+
+    def disconnect_dj(self, ws: WebSocket):
+        if ws in self.dj_connections:
+            self.dj_connections.remove(ws)
+        self._release(ws)
+
+    async def broadcast_to_dj(self, message: dict):
+        await self.bus.publish("dj", message)
+
+    async def connect_user(self, ws: WebSocket, solicitud_id: int):
+        await self._accept(ws)
+        if solicitud_id not in self.user_connections:
+            self.user_connections[solicitud_id] = []
+        self.user_connections[solicitud_id].append(ws)
+
+    def disconnect_user(self, ws: WebSocket, solicitud_id: int):
+        if solicitud_id in self.user_connections:
+            try: self.user_connections[solicitud_id].remove(ws)
+            except: pass
+            if not self.user_connections[solicitud_id]:
+                del self.user_connections[solicitud_id]
+        self._release(ws)
+
+    async def notify_user(self, solicitud_id: int, estado: str, cancion: str):
+        mensajes = {
+            "aprobada": f"✅ El DJ tiene tu canción. '{cancion}' viene pronto 🎶",
+            "rechazada": f"😔 El DJ no tiene '{cancion}' disponible ahora",
+            "reproducida": f"🎉 ¡Suena tu canción! '{cancion}' está en el aire",
+            "next_song": f"⚡ ¡Prepárate! '{cancion}' es la siguiente canción 🔥"
+        }
+        await self.bus.publish(f"usuario:{solicitud_id}", {"tipo": estado, "mensaje": mensajes.get(estado, "")})
+
+    async def connect_display(self, ws: WebSocket):
+        await self._accept(ws)
+        self.display_connections.append(ws)
+
+    def disconnect_display(self, ws: WebSocket):
+        if ws in self.display_connections:
+            self.display_connections.remove(ws)
+        self._release(ws)
+
+    async def broadcast_to_display(self, message: dict):
+        await self.bus.publish("display", message)
+
+    async def connect_cola(self, ws: WebSocket, evento_id: int):
+        await self._accept(ws)
+        if evento_id not in self.cola_connections:
+            self.cola_connections[evento_id] = []
+        self.cola_connections[evento_id].append(ws)
+
+    def disconnect_cola(self, ws: WebSocket, evento_id: int):
+        if evento_id in self.cola_connections:
+            try: self.cola_connections[evento_id].remove(ws)
+            except: pass
+            if not self.cola_connections[evento_id]:
+                del self.cola_connections[evento_id]
+        self._release(ws)
+
+    async def broadcast_to_cola(self, evento_id: int, message: dict):
+        await self.bus.publish(f"cola:{evento_id}", message)
+
+manager = ConnectionManager()
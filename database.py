@@ -1,10 +1,37 @@
 import aiosqlite
+import asyncio
 import os
+import time
+from contextlib import asynccontextmanager
 
-DB_PATH = "dj_request.db"
+from metricas import DB_DURACION, DB_ESPERA, LOTE_TAMANO
+
+DB_PATH = os.getenv("DB_PATH", "dj_request.db")
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+# Escrituras esperando el lock a partir de las cuales se rechazan requests nuevos
+DB_WRITE_QUEUE_MAX = int(os.getenv("DB_WRITE_QUEUE_MAX", "64"))
+# Escrituras agrupadas (ver Database.en_lote): espera maxima y tamaño del lote
+WRITE_BATCH_MS = float(os.getenv("WRITE_BATCH_MS", "5"))
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX", "100"))
+# FULL hace fsync en cada commit: con las escrituras agrupadas es uno por
+# lote, y un pedido confirmado sobrevive a un corte de luz. NORMAL (WAL)
+# ahorra el fsync pero puede perder los ultimos commits confirmados.
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "FULL")
+
+# Pragmas aplicados a todas las conexiones. WAL permite que los lectores
+# no bloqueen al escritor.
+PRAGMAS = [
+    "PRAGMA busy_timeout=5000",
+    f"PRAGMA synchronous={DB_SYNCHRONOUS}",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=67108864",
+]
 
 async def init_db():
+    """Tablas base. Indices y cambios posteriores: ver migraciones.py."""
     async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("PRAGMA journal_mode=WAL")
         await db.execute("""
             CREATE TABLE IF NOT EXISTS eventos (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -60,5 +87,195 @@ async def init_db():
         """)
         await db.commit()
 
+# ─── Pool de conexiones ───────────────────────────────────────────────
+class Database:
+    """Una conexion de escritura de larga vida + un pool de lectores.
+
+    SQLite solo admite un escritor a la vez, asi que todas las escrituras
+    pasan por la misma conexion protegida con un lock. Las lecturas usan
+    conexiones de solo lectura que en WAL corren en paralelo al escritor.
+
+    Las escrituras cortas y frecuentes (pedidos, votos) van por `en_lote`:
+    una tarea las junta durante WRITE_BATCH_MS (o hasta WRITE_BATCH_MAX) y
+    las aplica en una sola transaccion, con un commit por lote.
+    """
+
+    def __init__(self, path: str = DB_PATH, readers: int = DB_READERS):
+        self.path = path
+        self.n_readers = readers
+        self.writer: aiosqlite.Connection | None = None
+        self.readers: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._all_readers: list[aiosqlite.Connection] = []
+        self._write_lock = asyncio.Lock()
+        self.escrituras_pendientes = 0
+        self._lotes: asyncio.Queue | None = None
+        self._escritor: asyncio.Task | None = None
+
+    async def _connect(self, readonly: bool = False) -> aiosqlite.Connection:
+        if readonly:
+            conn = await aiosqlite.connect(f"file:{self.path}?mode=ro", uri=True)
+        else:
+            conn = await aiosqlite.connect(self.path)
+        conn.row_factory = aiosqlite.Row
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        if readonly:
+            await conn.execute("PRAGMA query_only=1")
+        else:
+            await conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    async def open(self):
+        if self.writer is not None:
+            return
+        self.writer = await self._connect()
+        for _ in range(self.n_readers):
+            conn = await self._connect(readonly=True)
+            self._all_readers.append(conn)
+            self.readers.put_nowait(conn)
+        self._lotes = asyncio.Queue()
+        self._escritor = asyncio.create_task(self._agrupar())
+
+    async def close(self):
+        if self._escritor is not None:
+            # None: terminar despues de aplicar lo que ya esta en la cola
+            self._lotes.put_nowait(None)
+            await self._escritor
+            self._escritor = None
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers.clear()
+        # Cola y lock nuevos: se pueden volver a abrir en otro event loop
+        self.readers = asyncio.Queue()
+        self._write_lock = asyncio.Lock()
+        if self.writer is not None:
+            await self.writer.close()
+            self.writer = None
+
+    @asynccontextmanager
+    async def read(self):
+        t0 = time.perf_counter()
+        conn = await self.readers.get()
+        t1 = time.perf_counter()
+        DB_ESPERA.observar(t1 - t0, "lectura")
+        try:
+            yield conn
+        finally:
+            self.readers.put_nowait(conn)
+            DB_DURACION.observar(time.perf_counter() - t1, "lectura")
+
+    @asynccontextmanager
+    async def write(self):
+        """Transaccion en la conexion de escritura: commit al salir, rollback si falla."""
+        t0 = time.perf_counter()
+        self.escrituras_pendientes += 1
+        try:
+            await self._write_lock.acquire()
+        finally:
+            self.escrituras_pendientes -= 1
+        try:
+            t1 = time.perf_counter()
+            DB_ESPERA.observar(t1 - t0, "escritura")
+            try:
+                yield self.writer
+                await self.writer.commit()
+            except BaseException:
+                await self.writer.rollback()
+                raise
+            finally:
+                DB_DURACION.observar(time.perf_counter() - t1, "escritura")
+        finally:
+            self._write_lock.release()
+
+    # ─── Escrituras agrupadas ─────────────────────────────────────────
+    async def en_lote(self, op, aplicar=None):
+        """Corre `await op(conn, lote)` en la proxima transaccion agrupada.
+
+        `lote` es un dict compartido por las operaciones del mismo lote (para
+        ver lo que otra ya inserto sin commitear). `aplicar(resultado)`, si
+        se pasa, corre apenas termina el commit, en el orden de las
+        operaciones, y su retorno es lo que se devuelve. Devolver significa
+        que el commit ya se hizo (y con synchronous=FULL, el default, que
+        paso el fsync); si la operacion falla se lanza su error y el resto
+        del lote sigue.
+        """
+        fut = asyncio.get_running_loop().create_future()
+        self.escrituras_pendientes += 1
+        self._lotes.put_nowait((op, aplicar, fut))
+        return await fut
+
+    async def _agrupar(self):
+        while True:
+            item = await self._lotes.get()
+            if item is None:
+                return
+            lote = [item]
+            limite = time.monotonic() + WRITE_BATCH_MS / 1000
+            fin = False
+            while len(lote) < WRITE_BATCH_MAX:
+                if self._lotes.empty():
+                    resto = limite - time.monotonic()
+                    if resto <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._lotes.get(), resto)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self._lotes.get_nowait()
+                if item is None:
+                    fin = True
+                    break
+                lote.append(item)
+            self.escrituras_pendientes -= len(lote)
+            await self._aplicar_lote(lote)
+            if fin:
+                return
+
+    async def _aplicar_lote(self, lote: list):
+        resultados = []
+        compartido = {}
+        try:
+            async with self.write() as conn:
+                await conn.execute("BEGIN IMMEDIATE")
+                for op, _, _ in lote:
+                    # Un savepoint por operacion: si una falla se deshace
+                    # solo esa y el resto del lote se commitea igual
+                    await conn.execute("SAVEPOINT op")
+                    try:
+                        resultados.append((True, await op(conn, compartido)))
+                        await conn.execute("RELEASE op")
+                    except Exception as e:
+                        await conn.execute("ROLLBACK TO op")
+                        await conn.execute("RELEASE op")
+                        resultados.append((False, e))
+        except Exception as e:
+            for _, _, fut in lote:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        LOTE_TAMANO.observar(len(lote))
+        for (_, aplicar, fut), (ok, r) in zip(lote, resultados):
+            if ok and aplicar is not None:
+                try:
+                    r = aplicar(r)
+                except Exception as e:
+                    ok, r = False, e
+            if fut.done():
+                continue
+            if ok:
+                fut.set_result(r)
+            else:
+                fut.set_exception(r)
+
+    def saturada(self) -> bool:
+        """True si ya hay DB_WRITE_QUEUE_MAX escrituras esperando (lock o lote)."""
+        return self.escrituras_pendientes >= DB_WRITE_QUEUE_MAX
+
+db = Database()
+
+# ─── Dependencias FastAPI ─────────────────────────────────────────────
 async def get_db():
-    return aiosqlite.connect(DB_PATH)
+    """Conexion de solo lectura del pool, devuelta al terminar el request."""
+    async with db.read() as conn:
+        yield conn
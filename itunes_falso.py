@@ -0,0 +1,96 @@
+"""iTunes falso para pruebas y benchmark, sin red.
+
+Responde GET /search con el mismo formato que la API de iTunes, despues de
+`ms` de latencia, y cuenta las llamadas. Con `fallar=True` responde 503.
+Se puede correr solo y apuntar la app a el:
+
+    python itunes_falso.py --port 9000 --ms 150
+    ITUNES_URL=http://127.0.0.1:9000/search uvicorn main:app
+
+o levantar dentro de un proceso async (tests, benchmark):
+
+    async with ITunesFalso(ms=50) as falso:
+        backend = ITunesBackend(falso.url)
+"""
+import argparse
+import asyncio
+import socket
+from collections import Counter
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+def track(term: str, n: int) -> dict:
+    return {
+        "trackId": abs(hash((term, n))) % 10**9,
+        "trackName": f"{term.title()} {n}",
+        "artistName": term.title(),
+        "collectionName": "Falso",
+        "artworkUrl100": f"https://example.invalid/{n}/100x100bb.jpg",
+        "previewUrl": None,
+        "trackTimeMillis": 180000,
+    }
+
+class ITunesFalso:
+    def __init__(self, ms: float = 0, host: str = "127.0.0.1", port: int = 0):
+        self.demora = ms / 1000
+        self.host = host
+        self.port = port
+        self.fallar = False
+        self.llamadas = 0
+        self.terminos: Counter[str] = Counter()
+        self.app = Starlette(routes=[Route("/search", self.search)])
+        self._server: uvicorn.Server | None = None
+        self._tarea: asyncio.Task | None = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/search"
+
+    async def search(self, request):
+        self.llamadas += 1
+        term = request.query_params.get("term", "")
+        self.terminos[term] += 1
+        if self.demora:
+            await asyncio.sleep(self.demora)
+        if self.fallar:
+            return JSONResponse({"errorMessage": "falso"}, status_code=503)
+        limit = int(request.query_params.get("limit", "8"))
+        resultados = [track(term, n) for n in range(limit)]
+        return JSONResponse({"resultCount": len(resultados), "results": resultados})
+
+    async def start(self):
+        if not self.port:
+            with socket.socket() as s:
+                s.bind((self.host, 0))
+                self.port = s.getsockname()[1]
+        self._server = uvicorn.Server(uvicorn.Config(self.app, host=self.host, port=self.port, log_level="warning"))
+        self._tarea = asyncio.create_task(self._server.serve())
+        while not self._server.started:
+            if self._tarea.done():
+                self._tarea.result()
+            await asyncio.sleep(0.01)
+
+    async def stop(self):
+        if self._tarea is not None:
+            self._server.should_exit = True
+            await self._tarea
+            self._tarea = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--ms", type=float, default=0, help="latencia de cada respuesta")
+    args = parser.parse_args()
+    falso = ITunesFalso(args.ms, args.host, args.port)
+    uvicorn.run(falso.app, host=args.host, port=args.port, log_level="warning")
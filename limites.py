@@ -0,0 +1,96 @@
+"""Rate limit por cliente y ruta.
+
+Un token bucket por (IP, ruta) en una tabla LRU acotada: las IPs que dejan
+de pedir se descartan solas. Los limites se configuran con RATE_LIMITS:
+
+    RATE_LIMITS="solicitar=0.2/3,mensaje=0.1/2,votar=2/10,buscar=2/8"
+
+(tokens por segundo / rafaga). Una ruta sin limite configurado no se limita.
+
+Por defecto no hay limites: en el WiFi de un salon todos los invitados salen
+por la misma IP (NAT), y detras de un proxy sin TRUST_PROXY=1 todos tienen
+la del proxy, asi que un bucket por IP limitaria a todo el salon como si
+fuera un solo telefono. Activarlos solo si cada invitado llega con su IP
+(datos moviles, o proxy con TRUST_PROXY=1 y X-Forwarded-For).
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+# Buckets (IP, ruta) en memoria antes de descartar los menos usados
+RATE_LIMIT_TABLE = int(os.getenv("RATE_LIMIT_TABLE", "10000"))
+
+class LimiteExcedido(Exception):
+    """El proximo token tardaria mas que la espera maxima."""
+
+    def __init__(self, espera: float):
+        super().__init__(f"token disponible en {espera:.2f} s")
+        self.espera = espera
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _recargar(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, max_espera: float | None = None):
+        """Toma un token, esperando si hace falta. Cada llamada reserva su
+        turno (los tokens pueden quedar negativos), asi la espera es exacta
+        aunque haya muchas en cola. Si seria mayor que `max_espera` no
+        reserva nada y lanza LimiteExcedido."""
+        self._recargar()
+        espera = max(0.0, (1 - self.tokens) / self.rate)
+        if max_espera is not None and espera > max_espera:
+            raise LimiteExcedido(espera)
+        self.tokens -= 1
+        if espera:
+            await asyncio.sleep(espera)
+
+    def intentar(self) -> float:
+        """Toma un token sin esperar. Devuelve 0, o los segundos que faltan."""
+        self._recargar()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+def parsear_limites(texto: str) -> dict[str, tuple[float, int]]:
+    limites = {}
+    for parte in texto.split(","):
+        if not parte.strip():
+            continue
+        ruta, _, valor = parte.partition("=")
+        rate, _, burst = valor.partition("/")
+        limites[ruta.strip()] = (float(rate), int(burst or 1))
+    return limites
+
+class RateLimiter:
+    def __init__(self, limites: dict[str, tuple[float, int]] | None = None, maxsize: int = RATE_LIMIT_TABLE):
+        self.limites = parsear_limites(RATE_LIMITS) if limites is None else limites
+        self.maxsize = maxsize
+        self._buckets: OrderedDict[tuple[str, str], TokenBucket] = OrderedDict()
+
+    def permitir(self, ip: str, ruta: str) -> float:
+        """0 si el request pasa; si no, los segundos hasta el proximo token."""
+        limite = self.limites.get(ruta)
+        if limite is None:
+            return 0
+        key = (ip, ruta)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*limite)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.intentar()
+
+limitador = RateLimiter()
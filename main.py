@@ -1,171 +1,270 @@
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, HTTPException, Form
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, FileResponse
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, HTTPException, Form, Depends
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from dotenv import load_dotenv
-import os, json, qrcode, io
-from PIL import Image
-from database import init_db, get_db
-from spotify import buscar_canciones
+import logging, os, math
+from database import init_db, get_db, db, DB_PATH
+from spotify import buscar_canciones, sincronizar_catalogo, servicio as busqueda
+from queue_state import colas, CAMPOS_PANEL, CAMPOS_SOLICITUD
+from connections import manager
+from votos import votaciones
+from qr import qr_cache
+from config_cache import config_cache
+import archivo
+import backup
+from migraciones import migrar
+import metricas
+from limites import LimiteExcedido, limitador
 from typing import Optional
-import aiosqlite
 
 load_dotenv()
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(levelname)s:  [%(name)s] %(message)s")
+# Una linea por llamada a iTunes: solo si se pide LOG_LEVEL=DEBUG
+if logging.getLogger().level > logging.DEBUG:
+    logging.getLogger("httpx").setLevel(logging.WARNING)
 
 app = FastAPI(title="DJ Song Request")
+if metricas.ACTIVAS or metricas.SLOW_REQUEST_MS:
+    app.add_middleware(metricas.MetricsMiddleware)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
 DJ_PASSWORD = os.getenv("DJ_PASSWORD", "dj1234")
-
-# ─── WebSocket Manager ────────────────────────────────────────────────
-class ConnectionManager:
-    def __init__(self):
-        self.dj_connections: list[WebSocket] = []
-        self.user_connections: dict[int, list[WebSocket]] = {}
-        self.display_connections: list[WebSocket] = []
-
-    async def connect_dj(self, ws: WebSocket):
-        await ws.accept()
-        self.dj_connections.append(ws)
-
-    def disconnect_dj(self, ws: WebSocket):
-        if ws in self.dj_connections:
-            self.dj_connections.remove(ws)
-
-    async def broadcast_to_dj(self, message: dict):
-        dead = []
-        for ws in self.dj_connections:
-            try:
-                await ws.send_json(message)
-            except:
-                dead.append(ws)
-        for ws in dead:
-            self.dj_connections.remove(ws)
-        # Tambien notificar a displays
-        await self.broadcast_to_display(message)
-
-    async def connect_user(self, ws: WebSocket, solicitud_id: int):
-        await ws.accept()
-        if solicitud_id not in self.user_connections:
-            self.user_connections[solicitud_id] = []
-        self.user_connections[solicitud_id].append(ws)
-
-    def disconnect_user(self, ws: WebSocket, solicitud_id: int):
-        if solicitud_id in self.user_connections:
-            try: self.user_connections[solicitud_id].remove(ws)
-            except: pass
-
-    async def notify_user(self, solicitud_id: int, estado: str, cancion: str):
-        mensajes = {
-            "aprobada": f"✅ El DJ tiene tu canción. '{cancion}' viene pronto 🎶",
-            "rechazada": f"😔 El DJ no tiene '{cancion}' disponible ahora",
-            "reproducida": f"🎉 ¡Suena tu canción! '{cancion}' está en el aire",
-            "next_song": f"⚡ ¡Prepárate! '{cancion}' es la siguiente canción 🔥"
-        }
-        conns = self.user_connections.get(solicitud_id, [])
-        dead = []
-        for ws in conns:
-            try:
-                await ws.send_json({"tipo": estado, "mensaje": mensajes.get(estado, "")})
-            except:
-                dead.append(ws)
-        for ws in dead:
-            try: conns.remove(ws)
-            except: pass
-
-    async def connect_display(self, ws: WebSocket):
-        await ws.accept()
-        self.display_connections.append(ws)
-
-    def disconnect_display(self, ws: WebSocket):
-        if ws in self.display_connections:
-            self.display_connections.remove(ws)
-
-    async def broadcast_to_display(self, message: dict):
-        dead = []
-        for ws in self.display_connections:
-            try:
-                await ws.send_json(message)
-            except:
-                dead.append(ws)
-        for ws in dead:
-            self.display_connections.remove(ws)
-
-manager = ConnectionManager()
+# Usar X-Forwarded-For solo si la app corre detras de un proxy de confianza
+TRUST_PROXY = os.getenv("TRUST_PROXY", "0") == "1"
+
+def client_ip(request: Request) -> str:
+    if TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else ""
+
+def limitar(ruta: str, escritura: bool = False):
+    """Dependencia: rate limit por IP para `ruta` y, si el endpoint escribe,
+    429 antes de tocar SQLite cuando la cola de escrituras esta llena."""
+    async def dependencia(request: Request):
+        espera = limitador.permitir(client_ip(request), ruta)
+        if espera:
+            metricas.RECHAZADOS.inc(ruta, "cliente")
+            raise HTTPException(429, "Demasiadas solicitudes, espera un momento",
+                                headers={"Retry-After": str(math.ceil(espera))})
+        if escritura and db.saturada():
+            metricas.RECHAZADOS.inc(ruta, "saturado")
+            raise HTTPException(429, "El servidor esta ocupado, intenta de nuevo", headers={"Retry-After": "1"})
+    return Depends(dependencia)
+
+def versionado(request: Request, etag: str, crear, cache: str = "no-cache") -> Response:
+    """304 si el cliente ya tiene `etag`; si no, la respuesta de `crear(headers)`."""
+    headers = {"ETag": etag, "Cache-Control": cache}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return crear(headers)
+
+def abrir_colas():
+    # Cola vacia para cada evento activo: un /ws/cola conectado antes del
+    # primer pedido recibe versiones continuas (las lecturas no crean colas)
+    for evento in config_cache.eventos_activos:
+        colas.evento(evento["id"])
+
+async def replicar_dj(message: dict) -> dict:
+    # Otro worker guardo la configuracion: recargar antes de avisar a los
+    # sockets locales, asi el panel que refresca ya ve la version nueva
+    if message.get("tipo") == "config_actualizada":
+        qr_cache.clear()
+        await config_cache.reload()
+    elif message.get("tipo") in ("evento_cerrado", "evento_creado"):
+        if message.get("evento_cerrado") is not None:
+            votaciones.descartar(colas.descartar(message["evento_cerrado"]))
+        await config_cache.reload()
+        abrir_colas()
+    return message
+
+metricas.Medidor("djreq_websockets_connected", "Sockets conectados por canal", "canal", manager.conteos)
+metricas.Medidor("djreq_search_cache_total", "Busquedas servidas desde el cache o el backend", "resultado",
+                 lambda: {"hit": busqueda.hits, "miss": busqueda.misses}, tipo="counter")
+metricas.Medidor("djreq_queue_rows", "Solicitudes en memoria por evento", "evento_id",
+                 lambda: {e: len(q.rows) for e, q in colas.events.items()})
+metricas.Medidor("djreq_queue_flush", "Write-behind de estados: cambios sin guardar y fallos seguidos", "valor",
+                 lambda: {"sin_guardar": colas.sin_guardar(), "fallos_seguidos": colas.fallos})
 
 # ─── Startup ──────────────────────────────────────────────────────────
 @app.on_event("startup")
 async def startup():
     await init_db()
-    # Migration: agregar columnas de redes sociales si no existen
-    async with aiosqlite.connect("dj_request.db") as db:
-        for col in ['instagram','tiktok','facebook','spotify_dj','website','tipo']:
-            try:
-                default = "'cancion'" if col == 'tipo' else "''"
-                tbl = 'solicitudes' if col == 'tipo' else 'configuracion'
-                await db.execute(f"ALTER TABLE {tbl} ADD COLUMN {col} TEXT DEFAULT {default}")
-                await db.commit()
-            except:
-                pass
-    async with aiosqlite.connect("dj_request.db") as db:
-        cursor = await db.execute("SELECT COUNT(*) FROM eventos")
+    await db.open()
+    await migrar(db)
+    async with db.write() as conn:
+        cursor = await conn.execute("SELECT COUNT(*) FROM eventos")
         count = (await cursor.fetchone())[0]
         if count == 0:
-            await db.execute("INSERT INTO eventos (nombre) VALUES ('Mi Evento')")
-            await db.commit()
+            await conn.execute("INSERT INTO eventos (nombre) VALUES ('Mi Evento')")
+    await config_cache.reload()
+    await colas.start()
+    abrir_colas()
+    manager.replicadores["cola"] = colas.aplicar_remoto
+    manager.replicadores["dj"] = replicar_dj
+    await manager.start()
+    await votaciones.load()
+    await sincronizar_catalogo(DB_PATH)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await votaciones.stop()
+    await manager.stop()
+    await colas.stop()
+    await busqueda.aclose()
+    await db.close()
 
 # ─── Landing Page (móvil) ─────────────────────────────────────────────
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
-    async with aiosqlite.connect("dj_request.db") as db:
-        cursor = await db.execute("SELECT id, nombre FROM eventos WHERE activo=1 LIMIT 1")
-        evento = await cursor.fetchone()
-    return templates.TemplateResponse("request.html", {
-        "request": request,
-        "evento": {"id": evento[0], "nombre": evento[1]} if evento else None
-    })
+    return pagina(request, "request.html", config_cache.evento_actual())
+
+def pagina(request: Request, nombre: str, evento: dict | None) -> Response:
+    # Las plantillas solo dependen del evento: se renderizan una vez por
+    # version de la configuracion y se sirven desde memoria
+    etag, html = config_cache.pagina(nombre, lambda: templates.get_template(nombre).render(evento=evento))
+    return versionado(request, etag, lambda headers: HTMLResponse(html, headers=headers))
 
 # ─── Buscar canciones ─────────────────────────────────────────────────
 @app.get("/api/buscar")
-async def buscar(q: str):
-    return await buscar_canciones(q)
+async def buscar(q: str, _=limitar("buscar")):
+    try:
+        return await buscar_canciones(q)
+    except LimiteExcedido as e:
+        # iTunes al limite y sin resultado viejo en cache: mejor un 429
+        # rapido que dejar al invitado esperando en la cola del bucket
+        metricas.RECHAZADOS.inc("buscar", "upstream")
+        raise HTTPException(429, "Demasiadas busquedas, intenta de nuevo", headers={"Retry-After": str(math.ceil(e.espera))})
 
 # ─── Solicitar canción ────────────────────────────────────────────────
 @app.post("/api/solicitar")
-async def solicitar(data: dict):
+async def solicitar(data: dict, request: Request, _=limitar("solicitar", escritura=True)):
     evento_id = data.get("evento_id", 1)
-    async with aiosqlite.connect("dj_request.db") as db:
-        cursor = await db.execute(
-            "INSERT INTO solicitudes (evento_id, cancion, artista, spotify_id, portada_url, dedicatoria) VALUES (?,?,?,?,?,?)",
-            (evento_id, data["cancion"], data["artista"], data.get("spotify_id",""), data.get("portada_url",""), data.get("dedicatoria",""))
-        )
-        await db.commit()
-        solicitud_id = cursor.lastrowid
+    ip = client_ip(request)
+    dedicatoria = data.get("dedicatoria","")
+    spotify_id = data.get("spotify_id","")
+    cancion, artista = data["cancion"], data["artista"]
+
+    async def insertar(conn, lote):
+        # Las operaciones del lote corren en orden en el unico escritor: dos
+        # pedidos simultaneos de la misma cancion no pueden crear dos filas,
+        # aunque la primera todavia no este commiteada (lote).
+        existente = colas.duplicado(evento_id, spotify_id) or lote.get((evento_id, spotify_id))
+        if existente is not None:
+            return await fusionar_sql(conn, existente, ip, dedicatoria)
+        row = await insertar_solicitud(conn, {
+            "evento_id": evento_id, "cancion": cancion, "artista": artista, "spotify_id": spotify_id,
+            "portada_url": data.get("portada_url",""), "dedicatoria": dedicatoria, "ip_solicitante": ip,
+        })
+        # El voto inicial (votos=1) es el del solicitante
+        await conn.execute("INSERT OR IGNORE INTO votos (solicitud_id, ip_votante) VALUES (?,?)", (row["id"], ip))
+        if spotify_id:
+            lote[(evento_id, spotify_id)] = row
+        return {"row": row}
+
+    def aplicar(r: dict) -> dict:
+        if "fusion" in r:
+            return aplicar_fusion(r)
+        votaciones.registrar(r["row"]["id"], ip)
+        colas.agregar(r["row"])
+        return r
+
+    r = await db.en_lote(insertar, aplicar)
+    if "fusion" in r:
+        return await avisar_fusion(r)
+    solicitud_id = r["row"]["id"]
+    # El delta se crea aca y no en aplicar: ver QueueState.delta_nueva
+    delta = colas.delta_nueva(solicitud_id)
+    if delta is not None:
+        await manager.broadcast_to_cola(evento_id, delta)
     await manager.broadcast_to_dj({
         "tipo": "nueva_solicitud",
         "id": solicitud_id,
-        "cancion": data["cancion"],
-        "artista": data["artista"],
+        "cancion": cancion,
+        "artista": artista,
         "portada_url": data.get("portada_url",""),
-        "dedicatoria": data.get("dedicatoria","")
+        "dedicatoria": dedicatoria
     })
     return {"id": solicitud_id, "ok": True}
 
+async def insertar_solicitud(conn, valores: dict) -> dict:
+    # El chequeo va en el mismo INSERT: un evento cerrado en otro worker, o
+    # antes en el mismo lote, ya no acepta filas nuevas
+    columnas = ", ".join(valores)
+    cursor = await conn.execute(
+        f"INSERT INTO solicitudes ({columnas}) SELECT {', '.join('?' * len(valores))} "
+        "WHERE EXISTS (SELECT 1 FROM eventos WHERE id=? AND activo=1) RETURNING *",
+        (*valores.values(), valores["evento_id"])
+    )
+    row = await cursor.fetchone()
+    if row is None:
+        raise HTTPException(409, "El evento está cerrado")
+    return dict(row)
+
+# Una cancion ya pedida (pendiente o aprobada) suma un voto y la dedicatoria
+# a la solicitud existente. Se devuelve su id para que el invitado se suscriba
+# a /ws/usuario/{id} de esa solicitud. Si un cierre anterior en el mismo lote
+# ya archivo la fila, el evento esta cerrado: 409.
+async def fusionar_sql(conn, row: dict, ip: str, dedicatoria: str) -> dict:
+    try:
+        votos = None if votaciones.ya_voto(row["id"], ip) else await votaciones.sumar(conn, row["id"], ip)
+    except HTTPException:
+        raise HTTPException(409, "El evento está cerrado")
+    nueva = None
+    if dedicatoria:
+        cursor = await conn.execute(
+            "UPDATE solicitudes SET dedicatoria = CASE WHEN COALESCE(dedicatoria,'')='' THEN ?1 "
+            "ELSE dedicatoria || ' · ' || ?1 END WHERE id=?2 RETURNING dedicatoria",
+            (dedicatoria, row["id"])
+        )
+        actualizada = await cursor.fetchone()
+        if actualizada is None:
+            raise HTTPException(409, "El evento está cerrado")
+        nueva = actualizada[0]
+    return {"fusion": row, "ip": ip, "votos": votos, "dedicatoria": nueva}
+
+def aplicar_fusion(r: dict) -> dict:
+    row = r["fusion"]
+    votaciones.confirmar(row["id"], r["ip"], r["votos"])
+    if r["dedicatoria"] is not None:
+        colas.set_dedicatoria(row["id"], r["dedicatoria"])
+    return r
+
+async def avisar_fusion(r: dict) -> dict:
+    row = r["fusion"]
+    delta = colas.delta_dedicatoria(row["id"]) if r["dedicatoria"] is not None else None
+    if delta is not None:
+        await manager.broadcast_to_cola(row["evento_id"], delta)
+        await manager.broadcast_to_dj({"tipo": "dedicatoria", "id": row["id"], "dedicatoria": r["dedicatoria"]})
+    return {"id": row["id"], "ok": True, "fusionada": True, "votos": r["votos"] if r["votos"] is not None else row["votos"]}
+
 @app.post("/api/mensaje-dj")
-async def mensaje_dj(data: dict):
+async def mensaje_dj(data: dict, request: Request, _=limitar("mensaje", escritura=True)):
     evento_id = data.get("evento_id", 1)
     texto = data.get("texto", "").strip()
     if not texto:
         raise HTTPException(400, "Texto requerido")
-    async with aiosqlite.connect("dj_request.db") as db:
-        cursor = await db.execute(
-            "INSERT INTO solicitudes (evento_id, cancion, artista, spotify_id, portada_url, dedicatoria, tipo) VALUES (?,?,?,?,?,?,?)",
-            (evento_id, texto, "✈️ Mensaje Directo", "", "", "", "mensaje")
-        )
-        await db.commit()
-        solicitud_id = cursor.lastrowid
+    ip = client_ip(request)
+
+    async def insertar(conn, lote):
+        return await insertar_solicitud(conn, {
+            "evento_id": evento_id, "cancion": texto, "artista": "✈️ Mensaje Directo", "spotify_id": "",
+            "portada_url": "", "dedicatoria": "", "tipo": "mensaje", "ip_solicitante": ip,
+        })
+
+    def aplicar(row: dict) -> dict:
+        colas.agregar(row)
+        return row
+
+    row = await db.en_lote(insertar, aplicar)
+    solicitud_id = row["id"]
+    delta = colas.delta_nueva(solicitud_id)
+    if delta is not None:
+        await manager.broadcast_to_cola(evento_id, delta)
     await manager.broadcast_to_dj({
         "tipo": "nueva_solicitud",
         "id": solicitud_id,
@@ -179,38 +278,36 @@ async def mensaje_dj(data: dict):
 
 # ─── Cola de solicitudes ──────────────────────────────────────────────
 @app.get("/api/cola/{evento_id}")
-async def cola(evento_id: int):
-    async with aiosqlite.connect("dj_request.db") as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
-            "SELECT * FROM solicitudes WHERE evento_id=? AND estado!='rechazada' ORDER BY votos DESC, id ASC",
-            (evento_id,)
-        )
-        rows = await cursor.fetchall()
-    return [dict(r) for r in rows]
+async def cola(evento_id: int, offset: int = 0, limit: Optional[int] = None):
+    # Servido desde memoria: slice del indice ordenado, sin tocar SQLite
+    return JSONResponse(colas.cola(evento_id, offset, limit))
 
 # ─── Panel DJ ─────────────────────────────────────────────────────────
 @app.get("/dj", response_class=HTMLResponse)
 async def dj_panel(request: Request):
-    async with aiosqlite.connect("dj_request.db") as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT * FROM eventos WHERE activo=1 ORDER BY id DESC LIMIT 1")
-        evento = await cursor.fetchone()
-    return templates.TemplateResponse("dj.html", {"request": request, "evento": evento})
+    return pagina(request, "dj.html", config_cache.evento_actual())
 
 # ─── DJ Solicitudes ───────────────────────────────────────────────────
 @app.get("/api/dj/solicitudes")
-async def dj_solicitudes(password: str, evento_id: int = 1):
+async def dj_solicitudes(password: str, evento_id: int = 1, estado: Optional[str] = None,
+                         tipo: Optional[str] = None, campos: Optional[str] = None, cursor: int = 0,
+                         limit: Optional[int] = None, since: Optional[int] = None, o: Optional[str] = None):
+    # estado/tipo/campos: listas separadas por coma. since + o: version del
+    # ultimo listado (ver "v" y "o" en la respuesta) para traer solo cambios.
     if password != DJ_PASSWORD:
         raise HTTPException(403, "Forbidden")
-    async with aiosqlite.connect("dj_request.db") as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
-            "SELECT * FROM solicitudes WHERE evento_id=? ORDER BY votos DESC, id ASC",
-            (evento_id,)
-        )
-        rows = await cursor.fetchall()
-    return [dict(r) for r in rows]
+    columnas = tuple(campos.split(",")) if campos else CAMPOS_PANEL
+    invalidas = set(columnas) - set(CAMPOS_SOLICITUD)
+    if invalidas:
+        raise HTTPException(400, f"Campos desconocidos: {', '.join(sorted(invalidas))}")
+    if limit is not None and limit < 1:
+        raise HTTPException(400, "limit debe ser mayor a 0")
+    return JSONResponse(colas.listar(
+        evento_id, columnas, cursor, limit,
+        estados=set(estado.split(",")) if estado else None,
+        tipos=set(tipo.split(",")) if tipo else None,
+        desde=since, origen=o,
+    ))
 
 # ─── Aprobar / Rechazar ───────────────────────────────────────────────
 @app.post("/api/dj/estado/{solicitud_id}")
@@ -218,15 +315,12 @@ async def cambiar_estado(solicitud_id: int, data: dict):
     if data.get("password") != DJ_PASSWORD:
         raise HTTPException(403, "Forbidden")
     estado = data["estado"]
-    async with aiosqlite.connect("dj_request.db") as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT cancion FROM solicitudes WHERE id=?", (solicitud_id,))
-        row = await cursor.fetchone()
-        if not row:
-            raise HTTPException(404, "Not found")
-        cancion = row["cancion"]
-        await db.execute("UPDATE solicitudes SET estado=? WHERE id=?", (estado, solicitud_id))
-        await db.commit()
+    row = colas.get(solicitud_id)
+    if not row:
+        raise HTTPException(404, "Not found")
+    cancion = row["cancion"]
+    # El delta sale antes que cualquier otro await (ver QueueState.delta_nueva)
+    await manager.broadcast_to_cola(row["evento_id"], colas.cambiar_estado(solicitud_id, estado))
     await manager.notify_user(solicitud_id, estado, cancion)
     await manager.broadcast_to_dj({"tipo": "estado_actualizado", "id": solicitud_id, "estado": estado})
     return {"ok": True}
@@ -236,26 +330,23 @@ async def cambiar_estado(solicitud_id: int, data: dict):
 async def next_song(solicitud_id: int, data: dict):
     if data.get("password") != DJ_PASSWORD:
         raise HTTPException(403, "Forbidden")
-    async with aiosqlite.connect("dj_request.db") as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT cancion FROM solicitudes WHERE id=?", (solicitud_id,))
-        row = await cursor.fetchone()
-        if not row:
-            raise HTTPException(404, "Not found")
-        cancion = row["cancion"]
+    row = colas.get(solicitud_id)
+    if not row:
+        raise HTTPException(404, "Not found")
+    cancion = row["cancion"]
     await manager.notify_user(solicitud_id, "next_song", cancion)
     return {"ok": True}
 
 # ─── Votar ────────────────────────────────────────────────────────────
 @app.post("/api/votar/{solicitud_id}")
-async def votar(solicitud_id: int):
-    async with aiosqlite.connect("dj_request.db") as db:
-        await db.execute("UPDATE solicitudes SET votos=votos+1 WHERE id=?", (solicitud_id,))
-        await db.commit()
-        cursor = await db.execute("SELECT votos FROM solicitudes WHERE id=?", (solicitud_id,))
-        row = await cursor.fetchone()
-    await manager.broadcast_to_dj({"tipo": "voto", "id": solicitud_id, "votos": row[0]})
-    return {"votos": row[0]}
+async def votar(solicitud_id: int, request: Request, _=limitar("votar", escritura=True)):
+    row = colas.get(solicitud_id)
+    if not row:
+        raise HTTPException(404, "Not found")
+    votos = await votaciones.votar(solicitud_id, client_ip(request))
+    if votos is None:
+        raise HTTPException(409, "Ya votaste por esta canción")
+    return {"votos": votos}
 
 # ─── WebSocket DJ ─────────────────────────────────────────────────────
 @app.websocket("/ws/dj")
@@ -277,14 +368,25 @@ async def ws_usuario(websocket: WebSocket, solicitud_id: int):
     except:
         manager.disconnect_user(websocket, solicitud_id)
 
+# ─── WebSocket Cola (publico) ─────────────────────────────────────────
+# Snapshot inicial + deltas versionados. Al reconectar, el cliente manda
+# ?desde=<ultima version>&o=<worker> y recibe solo lo que le falta (o un snapshot nuevo
+# si ya no estan en el log).
+@app.websocket("/ws/cola/{evento_id}")
+async def ws_cola(websocket: WebSocket, evento_id: int, desde: Optional[int] = None, o: Optional[str] = None):
+    await manager.connect_cola(websocket, evento_id)
+    try:
+        for msg in colas.resync(evento_id, desde, o):
+            manager.send(websocket, msg)
+        while True:
+            await websocket.receive_text()
+    except:
+        manager.disconnect_cola(websocket, evento_id)
+
 # ─── Display / Proyeccion ─────────────────────────────────────────────
 @app.get("/display", response_class=HTMLResponse)
 async def display_page(request: Request):
-    async with aiosqlite.connect("dj_request.db") as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT * FROM eventos WHERE activo=1 ORDER BY id DESC LIMIT 1")
-        evento = await cursor.fetchone()
-    return templates.TemplateResponse("display.html", {"request": request, "evento": evento})
+    return pagina(request, "display.html", config_cache.evento_actual())
 
 @app.websocket("/ws/display")
 async def ws_display(websocket: WebSocket):
@@ -308,24 +410,20 @@ async def dj_message(data: dict):
 
 # ─── Configuracion DJ ─────────────────────────────────────────────────
 @app.get("/api/dj/config")
-async def get_config(password: str, evento_id: int = 1):
+async def get_config(request: Request, password: str, evento_id: int = 1):
     if password != DJ_PASSWORD:
         raise HTTPException(403, "Forbidden")
-    async with aiosqlite.connect("dj_request.db") as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT * FROM configuracion WHERE evento_id=?", (evento_id,))
-        row = await cursor.fetchone()
-    if row:
-        return dict(row)
-    return {"evento_id": evento_id, "event_name": "Mi Evento", "subtitle": "DJ Request System", "logo_url": "", "cashapp": "", "venmo": "", "applepay": "", "love_text": "Show Your Love 💛", "instagram": "", "tiktok": "", "facebook": "", "spotify_dj": "", "website": ""}
+    config = config_cache.config(evento_id)
+    return versionado(request, config_cache.etag, lambda headers: JSONResponse(config, headers=headers),
+                      cache="private, no-cache")
 
 @app.post("/api/dj/config")
 async def save_config(data: dict):
     if data.get("password") != DJ_PASSWORD:
         raise HTTPException(403, "Forbidden")
     evento_id = data.get("evento_id", 1)
-    async with aiosqlite.connect("dj_request.db") as db:
-        await db.execute("""
+    async with db.write() as conn:
+        await conn.execute("""
             INSERT INTO configuracion (evento_id, event_name, subtitle, logo_url, cashapp, venmo, applepay, love_text, instagram, tiktok, facebook, spotify_dj, website)
             VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
             ON CONFLICT(evento_id) DO UPDATE SET
@@ -339,56 +437,108 @@ async def save_config(data: dict):
               data.get("applepay",""), data.get("love_text","Show Your Love 💛"),
               data.get("instagram",""), data.get("tiktok",""),
               data.get("facebook",""), data.get("spotify_dj",""), data.get("website","")))
-        await db.commit()
+    qr_cache.clear()
+    await config_cache.reload()
     await manager.broadcast_to_dj({"tipo": "config_actualizada"})
     return {"ok": True}
 
+# ─── Eventos ──────────────────────────────────────────────────────────
+@app.get("/api/dj/eventos")
+async def listar_eventos(password: str, conn=Depends(get_db)):
+    if password != DJ_PASSWORD:
+        raise HTTPException(403, "Forbidden")
+    return {"eventos": await archivo.listar(conn)}
+
+# Hay un solo evento en curso: crear uno cierra los activos, y cerrar uno
+# puede abrir el siguiente. Cerrar archiva solicitudes y votos (ver
+# archivo.py) y los saca de memoria. Va por el lote de escrituras: los
+# pedidos y votos encolados antes entran en el evento; los que llegan
+# despues reciben 409/404.
+async def cerrar_y_abrir(evento_id: int | None, nuevo: str | None, copiar_de: int | None = None) -> dict:
+    async def op(conn, lote):
+        ids = [evento_id] if evento_id is not None else await archivo.activos(conn)
+        cerrados = []
+        for eid in ids:
+            # Cambios de estado del panel que todavia no bajo el write-behind
+            await conn.executemany("UPDATE solicitudes SET estado=? WHERE id=?", colas.estados_pendientes(eid))
+            cerrados.append(await archivo.cerrar(conn, eid))
+        nuevo_id = None
+        if nuevo:
+            nuevo_id = await archivo.crear(conn, nuevo, copiar_de if copiar_de is not None else (ids[-1] if ids else None))
+        return {"cerrados": cerrados, "nuevo_id": nuevo_id}
+
+    def aplicar(r: dict) -> dict:
+        for c in r["cerrados"]:
+            votaciones.descartar(colas.descartar(c["evento_id"]))
+        return r
+
+    try:
+        r = await db.en_lote(op, aplicar)
+    except ValueError as e:
+        raise HTTPException(409, str(e))
+    await config_cache.reload()
+    abrir_colas()
+    for c in r["cerrados"]:
+        await manager.broadcast_to_dj({"tipo": "evento_cerrado", "evento_cerrado": c["evento_id"], "evento_id": r["nuevo_id"]})
+    if r["nuevo_id"] is not None:
+        await manager.broadcast_to_dj({"tipo": "evento_creado", "evento_id": r["nuevo_id"]})
+    return r
+
+@app.post("/api/dj/eventos")
+async def crear_evento(data: dict):
+    if data.get("password") != DJ_PASSWORD:
+        raise HTTPException(403, "Forbidden")
+    nombre = (data.get("nombre") or "").strip() or "Mi Evento"
+    r = await cerrar_y_abrir(None, nombre, data.get("copiar_de"))
+    return {"id": r["nuevo_id"], "cerrados": r["cerrados"], "ok": True}
+
+@app.post("/api/dj/eventos/{evento_id}/cerrar")
+async def cerrar_evento(evento_id: int, data: dict):
+    if data.get("password") != DJ_PASSWORD:
+        raise HTTPException(403, "Forbidden")
+    r = await cerrar_y_abrir(evento_id, (data.get("nuevo") or "").strip() or None)
+    return {"ok": True, "nuevo_id": r["nuevo_id"], **r["cerrados"][0]}
+
 @app.get("/api/config/publica")
-async def config_publica():
-    async with aiosqlite.connect("dj_request.db") as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT * FROM configuracion LIMIT 1")
-        row = await cursor.fetchone()
-    if row:
-        return dict(row)
-    return {"event_name": "DJ Request", "subtitle": "groovtek.com — DJ Request System", "logo_url": "", "love_text": "Show Your Love 💛"}
+async def config_publica(request: Request):
+    config = config_cache.publica
+    return versionado(request, config_cache.etag, lambda headers: JSONResponse(config, headers=headers))
+
+# ─── Metricas ─────────────────────────────────────────────────────────
+@app.get("/metrics")
+async def metrics():
+    if not metricas.ACTIVAS:
+        raise HTTPException(404, "Not found")
+    return Response(metricas.exportar(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # ─── QR Code ──────────────────────────────────────────────────────────
 @app.get("/api/dj/backup-db")
-async def backup_db(password: str):
+async def backup_db(password: str, formato: str = "json", gzip: bool = False):
     if password != DJ_PASSWORD:
         raise HTTPException(403, "Forbidden")
-    from fastapi.responses import PlainTextResponse
     import datetime
-    async with aiosqlite.connect("dj_request.db") as db:
-        db.row_factory = aiosqlite.Row
-        # Export all tables as JSON
-        data = {}
-        for table in ["eventos","solicitudes","configuracion","votos"]:
-            cursor = await db.execute(f"SELECT * FROM {table}")
-            rows = await cursor.fetchall()
-            data[table] = [dict(r) for r in rows]
-    import json
-    filename = f"groovtek_backup_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.json"
-    from fastapi.responses import Response
-    return Response(
-        content=json.dumps(data, indent=2, default=str),
-        media_type="application/json",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    try:
+        partes = backup.exportar(formato, gzip)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    filename = f"groovtek_backup_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.{formato}"
+    media_type = backup.FORMATOS[formato]
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(partes, media_type=media_type,
+                             headers={"Content-Disposition": f"attachment; filename={filename}"})
 
 @app.get("/qr")
-async def qr_code():
-    target = BASE_URL
-    qr = qrcode.QRCode(version=1, box_size=10, border=4)
-    qr.add_data(target)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="#0a0a0a", back_color="white")
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    from fastapi.responses import StreamingResponse
-    return StreamingResponse(buf, media_type="image/png")
+async def qr_code(request: Request, size: int = 10, fill: str = "#0a0a0a", back: str = "white",
+                  fmt: str = "png", logo: bool = False):
+    try:
+        asset = await qr_cache.get(BASE_URL, size, fill, back, fmt, logo)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return versionado(request, asset.etag,
+                      lambda headers: Response(content=asset.body, media_type=asset.media_type, headers=headers),
+                      cache="public, max-age=3600")
 
 @app.get("/qr/page", response_class=HTMLResponse)
 async def qr_page(request: Request):
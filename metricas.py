@@ -0,0 +1,158 @@
+"""Metricas internas en formato de texto de Prometheus (GET /metrics).
+
+Sin dependencias: contadores e histogramas en memoria de este proceso (con
+varios workers, cada uno expone los suyos). Con METRICS=0 no se instala el
+middleware y observar/inc vuelven en la primera linea.
+
+SLOW_REQUEST_MS > 0 loguea los requests que tardan mas que eso.
+"""
+import logging
+import os
+import time
+from bisect import bisect_left
+
+ACTIVAS = os.getenv("METRICS", "1") == "1"
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registro: list = []
+log = logging.getLogger(__name__)
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _etiquetas(nombres: tuple, valores: tuple, extra: str = "") -> str:
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+class Contador:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.valores: dict[tuple, float] = {}
+        _registro.append(self)
+
+    def inc(self, *labels, n: float = 1):
+        if not ACTIVAS:
+            return
+        self.valores[labels] = self.valores.get(labels, 0) + n
+
+    def exportar(self) -> list[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        for labels, v in sorted(self.valores.items()):
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, labels)} {v}")
+        return lineas
+
+class Histograma:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = (), buckets: tuple = BUCKETS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        # labels -> [conteo por bucket (+Inf al final), suma]
+        self.series: dict[tuple, list] = {}
+        _registro.append(self)
+
+    def observar(self, valor: float, *labels):
+        if not ACTIVAS:
+            return
+        serie = self.series.get(labels)
+        if serie is None:
+            serie = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        serie[0][bisect_left(self.buckets, valor)] += 1
+        serie[1] += valor
+
+    def exportar(self) -> list[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for labels, (conteos, suma) in sorted(self.series.items()):
+            acumulado = 0
+            for le, n in zip(self.buckets + ("+Inf",), conteos):
+                acumulado += n
+                le = 'le="' + str(le) + '"'
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, labels, le)} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, labels)} {suma}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, labels)} {acumulado}")
+        return lineas
+
+class Medidor:
+    """Valor calculado al momento de exportar: fn() -> {valor_etiqueta: numero}.
+
+    No cuesta nada en el camino caliente; sirve para conteos que ya existen
+    en otro lado (sockets conectados, hits del cache de busqueda).
+    """
+
+    def __init__(self, nombre: str, ayuda: str, etiqueta: str, fn, tipo: str = "gauge"):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiqueta = etiqueta
+        self.fn = fn
+        self.tipo = tipo
+        _registro.append(self)
+
+    def exportar(self) -> list[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        for valor, n in sorted(self.fn().items()):
+            lineas.append(f"{self.nombre}{_etiquetas((self.etiqueta,), (valor,))} {n}")
+        return lineas
+
+def exportar() -> str:
+    lineas = []
+    for metrica in _registro:
+        lineas.extend(metrica.exportar())
+    return "\n".join(lineas) + "\n"
+
+# ─── Metricas de la app ───────────────────────────────────────────────
+HTTP_LATENCIA = Histograma("djreq_http_request_duration_seconds", "Duracion de requests HTTP por ruta",
+                           ("method", "route", "status"))
+DB_ESPERA = Histograma("djreq_db_wait_seconds", "Espera por el lock de escritura o un lector del pool", ("modo",))
+DB_DURACION = Histograma("djreq_db_duration_seconds", "Duracion de transacciones de escritura y lecturas", ("modo",))
+LOTE_TAMANO = Histograma("djreq_db_batch_size", "Operaciones por transaccion agrupada", (),
+                         buckets=(1, 2, 5, 10, 25, 50, 100, 250))
+BUSQUEDA_LATENCIA = Histograma("djreq_search_upstream_seconds", "Latencia del backend de busqueda", ("backend",))
+BUSQUEDA_ERRORES = Contador("djreq_search_upstream_errors_total", "Errores del backend de busqueda", ("backend",))
+FANOUT_DURACION = Histograma("djreq_broadcast_fanout_seconds", "Tiempo en serializar y encolar un broadcast",
+                             ("canal",), buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05))
+FANOUT_SOCKETS = Contador("djreq_broadcast_deliveries_total", "Mensajes encolados a sockets", ("canal",))
+SOCKETS_DESCARTADOS = Contador("djreq_websocket_dropped_total",
+                               "Sockets cortados o mensajes descartados por lentitud o error", ("motivo",))
+
+RECHAZADOS = Contador("djreq_rate_limited_total", "Requests rechazados con 429", ("ruta", "motivo"))
+ERRORES_FONDO = Contador("djreq_background_errors_total", "Errores en tareas de fondo (write-behind, bus)", ("tarea",))
+
+# ─── Middleware ───────────────────────────────────────────────────────
+class MetricsMiddleware:
+    """Middleware ASGI: latencia por ruta (plantilla, no la URL con ids) y log
+    de requests lentos. Los WebSockets pasan sin medir."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = [500]
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            dur = time.perf_counter() - t0
+            route = scope.get("route")
+            if route is not None:
+                ruta = route.path
+            elif scope["path"].startswith("/static/"):
+                ruta = "/static"
+            else:
+                ruta = "otra"
+            HTTP_LATENCIA.observar(dur, scope["method"], ruta, status[0])
+            if SLOW_REQUEST_MS and dur * 1000 > SLOW_REQUEST_MS:
+                log.warning("lento: %s %s %s %.0f ms", scope["method"], scope["path"], status[0], dur * 1000)
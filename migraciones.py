@@ -0,0 +1,106 @@
+"""Migraciones de esquema versionadas con PRAGMA user_version.
+
+init_db crea las tablas base; cada migracion de MIGRACIONES lleva la base
+de la version i a la i+1. Las pendientes corren en orden dentro de una sola
+transaccion (si una falla no queda nada a medias) y al final se guarda la
+version nueva. Para cambiar el esquema: agregar una funcion al final de la
+lista, nunca editar una que ya se publico.
+"""
+import logging
+
+log = logging.getLogger(__name__)
+
+async def _columnas(conn, tabla: str) -> set[str]:
+    cursor = await conn.execute(f"PRAGMA table_info({tabla})")
+    return {r[1] for r in await cursor.fetchall()}
+
+async def m001_columnas_agregadas(conn):
+    """Columnas que se sumaron despues de la primera version (antes: loop de
+    ALTER TABLE en el startup). Solo faltan en bases muy viejas."""
+    faltantes = {
+        "configuracion": [(c, "''") for c in ("instagram", "tiktok", "facebook", "spotify_dj", "website")],
+        "solicitudes": [("tipo", "'cancion'"), ("ip_solicitante", "NULL")],
+    }
+    for tabla, columnas in faltantes.items():
+        existentes = await _columnas(conn, tabla)
+        for col, default in columnas:
+            if col not in existentes:
+                await conn.execute(f"ALTER TABLE {tabla} ADD COLUMN {col} TEXT DEFAULT {default}")
+
+async def m002_indices(conn):
+    # Cola de un evento: WHERE evento_id=? ORDER BY votos DESC, id
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_solicitudes_cola
+        ON solicitudes (evento_id, votos DESC, id)
+    """)
+    # Solicitudes repetidas de la misma cancion (ya existia en bases anteriores)
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_solicitudes_duplicado
+        ON solicitudes (evento_id, spotify_id, estado)
+    """)
+    # Los votos ya tienen UNIQUE(solicitud_id, ip_votante), que es el indice
+    # de la busqueda de INSERT OR IGNORE; no hace falta otro.
+
+async def m003_archivo(conn):
+    """Tablas de eventos cerrados (ver archivo.py)."""
+    if "cerrado_en" not in await _columnas(conn, "eventos"):
+        await conn.execute("ALTER TABLE eventos ADD COLUMN cerrado_en TIMESTAMP")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS solicitudes_archivo (
+            id INTEGER PRIMARY KEY,
+            evento_id INTEGER NOT NULL,
+            cancion TEXT NOT NULL,
+            artista TEXT NOT NULL,
+            spotify_id TEXT,
+            portada_url TEXT,
+            dedicatoria TEXT,
+            votos INTEGER,
+            estado TEXT,
+            tipo TEXT,
+            ip_solicitante TEXT,
+            creado_en TIMESTAMP
+        )
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_archivo_evento ON solicitudes_archivo (evento_id)")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS votos_archivo (
+            id INTEGER PRIMARY KEY,
+            solicitud_id INTEGER NOT NULL,
+            ip_votante TEXT NOT NULL,
+            creado_en TIMESTAMP
+        )
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_votos_archivo ON votos_archivo (solicitud_id)")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS resumen_eventos (
+            evento_id INTEGER PRIMARY KEY,
+            canciones INTEGER,
+            mensajes INTEGER,
+            reproducidas INTEGER,
+            rechazadas INTEGER,
+            votos INTEGER,
+            votantes INTEGER,
+            top TEXT  -- JSON: [{cancion, artista, spotify_id, votos, estado}]
+        )
+    """)
+
+MIGRACIONES = [
+    m001_columnas_agregadas,
+    m002_indices,
+    m003_archivo,
+]
+
+async def migrar(db) -> int:
+    """Aplica las migraciones pendientes. Devuelve la version final."""
+    async with db.write() as conn:
+        # IMMEDIATE toma el lock de escritura antes de leer la version: si
+        # varios workers arrancan juntos, solo uno migra y el resto espera.
+        await conn.execute("BEGIN IMMEDIATE")
+        cursor = await conn.execute("PRAGMA user_version")
+        version = (await cursor.fetchone())[0]
+        for migracion in MIGRACIONES[version:]:
+            await migracion(conn)
+        if version < len(MIGRACIONES):
+            await conn.execute(f"PRAGMA user_version={len(MIGRACIONES)}")
+            log.info("base migrada de la version %d a la %d", version, len(MIGRACIONES))
+    return max(version, len(MIGRACIONES))
@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import io
+import os
+from collections import OrderedDict
+
+import qrcode
+from PIL import Image, ImageColor
+
+# Logo opcional para superponer en el centro del QR
+QR_LOGO = os.getenv("QR_LOGO", "static/logo.png")
+QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE", "64"))
+
+FORMATOS = {"png": "image/png", "svg": "image/svg+xml"}
+
+class QRAsset:
+    def __init__(self, body: bytes, media_type: str):
+        self.body = body
+        self.media_type = media_type
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+def _matriz(target: str, con_logo: bool) -> qrcode.QRCode:
+    # Con logo se tapa el centro: correccion de errores H (30%) para que siga leyendo
+    correccion = qrcode.constants.ERROR_CORRECT_H if con_logo else qrcode.constants.ERROR_CORRECT_M
+    qr = qrcode.QRCode(version=1, error_correction=correccion, box_size=10, border=4)
+    qr.add_data(target)
+    qr.make(fit=True)
+    return qr
+
+def _render_png(target: str, size: int, fill: str, back: str, con_logo: bool) -> bytes:
+    qr = _matriz(target, con_logo)
+    qr.box_size = size
+    img = qr.make_image(fill_color=fill, back_color=back).get_image().convert("RGB")
+    if con_logo:
+        logo = Image.open(QR_LOGO).convert("RGBA")
+        lado = img.size[0] // 4
+        logo.thumbnail((lado, lado))
+        pos = ((img.size[0] - logo.size[0]) // 2, (img.size[1] - logo.size[1]) // 2)
+        img.paste(logo, pos, logo)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+def _render_svg(target: str, size: int, fill: str, back: str) -> bytes:
+    matriz = _matriz(target, False).get_matrix()
+    n = len(matriz)
+    path = "".join(
+        f"M{x},{y}h1v1h-1z"
+        for y, fila in enumerate(matriz) for x, oscuro in enumerate(fila) if oscuro
+    )
+    svg = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {n} {n}" '
+        f'width="{n * size}" height="{n * size}" shape-rendering="crispEdges">'
+        f'<rect width="{n}" height="{n}" fill="{back}"/><path d="{path}" fill="{fill}"/></svg>'
+    )
+    return svg.encode()
+
+class QRCache:
+    """QR renderizados una sola vez por (url, tamaño, colores, formato, logo).
+
+    Se vacia cuando cambia la configuracion del DJ (ver save_config).
+    """
+
+    def __init__(self, maxsize: int = QR_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._assets: OrderedDict[tuple, QRAsset] = OrderedDict()
+
+    @staticmethod
+    def validar(size: int, fill: str, back: str, fmt: str) -> None:
+        if fmt not in FORMATOS:
+            raise ValueError(f"Formato no soportado: {fmt}")
+        if not 1 <= size <= 40:
+            raise ValueError("size debe estar entre 1 y 40")
+        for color in (fill, back):
+            ImageColor.getrgb(color)  # ValueError si no es un color valido
+
+    async def get(self, target: str, size: int = 10, fill: str = "#0a0a0a",
+                  back: str = "white", fmt: str = "png", logo: bool = False) -> QRAsset:
+        self.validar(size, fill, back, fmt)
+        logo = logo and fmt == "png" and os.path.exists(QR_LOGO)
+        key = (target, size, fill, back, fmt, logo)
+        asset = self._assets.get(key)
+        if asset is None:
+            if fmt == "svg":
+                body = _render_svg(target, size, fill, back)
+            else:
+                # PIL es CPU: fuera del event loop
+                body = await asyncio.to_thread(_render_png, target, size, fill, back, logo)
+            asset = QRAsset(body, FORMATOS[fmt])
+            self._assets[key] = asset
+            while len(self._assets) > self.maxsize:
+                self._assets.popitem(last=False)
+        self._assets.move_to_end(key)
+        return asset
+
+    def clear(self):
+        self._assets.clear()
+
+qr_cache = QRCache()
@@ -0,0 +1,405 @@
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+
+from bus import ORIGEN
+from database import db
+from metricas import ERRORES_FONDO
+
+QUEUE_FLUSH_MS = int(os.getenv("QUEUE_FLUSH_MS", "50"))
+# Espera maxima entre reintentos cuando el flush falla seguido
+QUEUE_FLUSH_MAX_MS = int(os.getenv("QUEUE_FLUSH_MAX_MS", "5000"))
+# Deltas recientes que se guardan por evento para reanudar clientes
+QUEUE_LOG_SIZE = int(os.getenv("QUEUE_LOG_SIZE", "1000"))
+# Estados en los que una solicitud repetida se fusiona con la existente
+ESTADOS_FUSIONABLES = ("pendiente", "aprobada")
+# Columnas que muestra el panel del DJ (proyeccion por defecto del listado)
+CAMPOS_PANEL = ("id", "cancion", "artista", "portada_url", "dedicatoria", "votos", "estado", "tipo")
+# Columnas de la cola publica (/api/cola, /ws/cola): nunca la IP del invitado
+CAMPOS_PUBLICOS = CAMPOS_PANEL + ("evento_id", "spotify_id", "creado_en")
+CAMPOS_SOLICITUD = CAMPOS_PUBLICOS + ("ip_solicitante",)
+
+log = logging.getLogger(__name__)
+
+# ─── Cola de un evento ────────────────────────────────────────────────
+class EventQueue:
+    """Solicitudes de un evento con un indice ordenado por (votos DESC, id ASC).
+
+    El indice guarda claves (-votos, id) de las solicitudes visibles en la
+    cola (todas menos las rechazadas), asi que leer la cola es un slice.
+
+    Cada cambio publico incrementa `version` y queda en `log` para que los
+    clientes de /ws/cola puedan reanudar desde su ultima version. La version
+    arranca en milisegundos desde epoch para que siga creciendo entre
+    reinicios del servidor. `cambios` guarda la ultima version en la que
+    cambio cada solicitud, para los listados incrementales del panel.
+    """
+
+    def __init__(self):
+        self.rows: dict[int, dict] = {}
+        self.index: list[tuple[int, int]] = []
+        # spotify_id -> id de la solicitud canonica (pendiente o aprobada)
+        self.canonicas: dict[str, int] = {}
+        self.version = int(time.time() * 1000)
+        self.log: deque[dict] = deque(maxlen=QUEUE_LOG_SIZE)
+        self.ids: list[int] = []
+        self.cambios: dict[int, int] = {}
+
+    def delta(self, op: str, **payload) -> dict:
+        self.version += 1
+        msg = {"tipo": "cola_delta", "v": self.version, "op": op, **payload}
+        self.log.append(msg)
+        self.cambios[payload["row"]["id"] if "row" in payload else payload["id"]] = self.version
+        return msg
+
+    def snapshot(self) -> dict:
+        return {"tipo": "cola_snapshot", "v": self.version, "o": ORIGEN, "cola": self.cola()}
+
+    def resync(self, desde: int | None, origen: str | None = None) -> list[dict]:
+        """Mensajes para llevar a un cliente de la version `desde` a la actual.
+
+        Las versiones son de este proceso: si el cliente viene de otro worker
+        (`origen` distinto) recibe un snapshot.
+        """
+        if origen is not None and origen != ORIGEN:
+            return [self.snapshot()]
+        if desde == self.version:
+            return []
+        if desde is not None and self.log and self.log[0]["v"] - 1 <= desde < self.version:
+            return [d for d in self.log if d["v"] > desde]
+        return [self.snapshot()]
+
+    @staticmethod
+    def publica(row: dict) -> dict:
+        return {c: row.get(c) for c in CAMPOS_PUBLICOS}
+
+    @staticmethod
+    def _key(row: dict) -> tuple[int, int]:
+        return (-(row["votos"] or 0), row["id"])
+
+    @staticmethod
+    def _visible(row: dict) -> bool:
+        return row["estado"] != "rechazada"
+
+    def _unindex(self, row: dict):
+        key = self._key(row)
+        i = bisect_left(self.index, key)
+        if i < len(self.index) and self.index[i] == key:
+            del self.index[i]
+
+    @staticmethod
+    def _fusionable(row: dict) -> bool:
+        return bool(row.get("spotify_id")) and row.get("tipo", "cancion") != "mensaje" \
+            and row["estado"] in ESTADOS_FUSIONABLES
+
+    def _actualizar_canonica(self, row: dict):
+        sid = row.get("spotify_id")
+        if not sid:
+            return
+        if self._fusionable(row):
+            self.canonicas.setdefault(sid, row["id"])
+        elif self.canonicas.get(sid) == row["id"]:
+            del self.canonicas[sid]
+            # Puede quedar otra solicitud activa de la misma cancion
+            for otra in self.rows.values():
+                if otra.get("spotify_id") == sid and self._fusionable(otra):
+                    self.canonicas[sid] = otra["id"]
+                    break
+
+    def agregar(self, row: dict):
+        if row["id"] not in self.rows:
+            insort(self.ids, row["id"])
+        self.rows[row["id"]] = row
+        if self._visible(row):
+            insort(self.index, self._key(row))
+        self._actualizar_canonica(row)
+
+    def set_votos(self, solicitud_id: int, votos: int):
+        row = self.rows[solicitud_id]
+        visible = self._visible(row)
+        if visible:
+            self._unindex(row)
+        row["votos"] = votos
+        if visible:
+            insort(self.index, self._key(row))
+
+    def set_estado(self, solicitud_id: int, estado: str):
+        row = self.rows[solicitud_id]
+        if self._visible(row):
+            self._unindex(row)
+        row["estado"] = estado
+        if self._visible(row):
+            insort(self.index, self._key(row))
+        self._actualizar_canonica(row)
+
+    def cola(self, offset: int = 0, limit: int | None = None) -> list[dict]:
+        end = None if limit is None else offset + limit
+        return [self.publica(self.rows[i]) for _, i in self.index[offset:end]]
+
+    def listar(self, cursor: int = 0, limit: int | None = None, estados=None, tipos=None,
+               desde: int | None = None) -> tuple[list[dict], int | None]:
+        """Solicitudes por id ascendente despues de `cursor`, filtradas.
+
+        Con `desde` solo las que cambiaron despues de esa version. Devuelve
+        (filas, cursor siguiente o None si no hay mas).
+        """
+        if desde is None:
+            ids = self.ids[bisect_right(self.ids, cursor):]
+        else:
+            ids = sorted(i for i, v in self.cambios.items() if v > desde and i > cursor)
+        filas = []
+        for i in ids:
+            row = self.rows[i]
+            if estados and row["estado"] not in estados:
+                continue
+            if tipos and (row.get("tipo") or "cancion") not in tipos:
+                continue
+            if limit is not None and len(filas) == limit:
+                return filas, filas[-1]["id"]
+            filas.append(row)
+        return filas, None
+
+# ─── Estado global + write-behind ─────────────────────────────────────
+class QueueState:
+    """Colas en memoria de todos los eventos.
+
+    La memoria es la fuente de verdad para lecturas. Los cambios de estado
+    se aplican aqui al instante y se escriben a SQLite en lotes cada
+    QUEUE_FLUSH_MS milisegundos en una sola transaccion. Los votos se
+    persisten en el momento desde votos.py y aqui solo se reflejan.
+
+    Si el flush falla, los cambios quedan pendientes y se reintenta con
+    espera creciente (hasta QUEUE_FLUSH_MAX_MS). `fallos` cuenta los
+    intentos fallidos seguidos; se exporta en /metrics junto con los
+    cambios sin guardar.
+    """
+
+    def __init__(self, flush_ms: int = QUEUE_FLUSH_MS):
+        self.events: dict[int, EventQueue] = {}
+        self.evento_de: dict[int, int] = {}
+        self.flush_interval = flush_ms / 1000
+        self._pending_estado: dict[int, str] = {}
+        self.fallos = 0
+        self._flush_task: asyncio.Task | None = None
+
+    def evento(self, evento_id: int) -> EventQueue:
+        """Cola del evento, creandola. Solo para escrituras (agregar): las
+        lecturas publicas usan events.get y no guardan nada para ids
+        desconocidos o cerrados."""
+        if evento_id not in self.events:
+            self.events[evento_id] = EventQueue()
+        return self.events[evento_id]
+
+    async def load(self):
+        self.events.clear()
+        self.evento_de.clear()
+        async with db.read() as conn:
+            cursor = await conn.execute("SELECT * FROM solicitudes ORDER BY id")
+            for r in await cursor.fetchall():
+                self.agregar(dict(r))
+
+    def agregar(self, row: dict):
+        self.evento(row["evento_id"]).agregar(row)
+        self.evento_de[row["id"]] = row["evento_id"]
+
+    def get(self, solicitud_id: int) -> dict | None:
+        evento_id = self.evento_de.get(solicitud_id)
+        if evento_id is None:
+            return None
+        return self.events[evento_id].rows.get(solicitud_id)
+
+    def duplicado(self, evento_id: int, spotify_id: str) -> dict | None:
+        """Solicitud activa de la misma cancion en el evento, si existe."""
+        q = self.events.get(evento_id)
+        if not spotify_id or q is None:
+            return None
+        solicitud_id = q.canonicas.get(spotify_id)
+        return self.get(solicitud_id) if solicitud_id is not None else None
+
+    def set_dedicatoria(self, solicitud_id: int, dedicatoria: str):
+        """Como set_votos: solo memoria, el delta sale de delta_dedicatoria."""
+        self.get(solicitud_id)["dedicatoria"] = dedicatoria
+
+    def delta_dedicatoria(self, solicitud_id: int) -> dict | None:
+        row = self.get(solicitud_id)
+        if row is None:
+            return None
+        return self.events[row["evento_id"]].delta("dedicatoria", id=solicitud_id, dedicatoria=row["dedicatoria"])
+
+    def cola(self, evento_id: int, offset: int = 0, limit: int | None = None) -> list[dict]:
+        q = self.events.get(evento_id)
+        return q.cola(offset, limit) if q is not None else []
+
+    def listar(self, evento_id: int, campos=CAMPOS_PANEL, cursor: int = 0, limit: int | None = None,
+               estados=None, tipos=None, desde: int | None = None, origen: str | None = None) -> dict:
+        """Listado paginado del panel. `desde` solo vale si la version es de
+        este proceso (mismo `origen`); si no, se devuelve todo y completo=True."""
+        q = self.events.get(evento_id)
+        if q is None:
+            return {"solicitudes": [], "cursor": None, "v": 0, "o": ORIGEN, "completo": True}
+        if desde is not None and origen != ORIGEN:
+            desde = None
+        filas, siguiente = q.listar(cursor, limit, estados, tipos, desde)
+        return {
+            "solicitudes": [{c: r.get(c) for c in campos} for r in filas],
+            "cursor": siguiente,
+            "v": q.version,
+            "o": ORIGEN,
+            "completo": desde is None,
+        }
+
+    def resync(self, evento_id: int, desde: int | None = None, origen: str | None = None) -> list[dict]:
+        q = self.events.get(evento_id)
+        if q is None:
+            return [{"tipo": "cola_snapshot", "v": 0, "o": ORIGEN, "cola": []}]
+        return q.resync(desde, origen)
+
+    def aplicar_remoto(self, delta: dict) -> dict | None:
+        """Aplica un delta publicado por otro worker (ver bus.py).
+
+        El worker de origen ya lo persistio; aca solo se refleja en memoria y
+        se devuelve el mismo cambio con una version de este proceso.
+        """
+        op = delta.get("op")
+        if op == "nueva":
+            row = delta["row"]
+            if self.get(row["id"]) is None:
+                return self.nueva(dict(row))
+            q = self.events[row["evento_id"]]
+            q.set_estado(row["id"], row["estado"])
+            return q.delta("nueva", row=q.publica(q.rows[row["id"]]))
+        row = self.get(delta.get("id"))
+        if row is None:
+            return None
+        q = self.events[row["evento_id"]]
+        if op == "votos":
+            q.set_votos(row["id"], delta["votos"])
+            return q.delta("votos", id=row["id"], votos=delta["votos"])
+        if op == "estado":
+            q.set_estado(row["id"], delta["estado"])
+            return q.delta("estado", id=row["id"], estado=delta["estado"])
+        if op == "eliminada":
+            q.set_estado(row["id"], "rechazada")
+            return q.delta("eliminada", id=row["id"])
+        if op == "dedicatoria":
+            self.set_dedicatoria(row["id"], delta["dedicatoria"])
+            return self.delta_dedicatoria(row["id"])
+        return None
+
+    def nueva(self, row: dict) -> dict:
+        """Agrega una solicitud recien insertada y devuelve su delta.
+
+        El delta lleva solo las columnas publicas; los otros workers lo
+        replican asi, sin la IP del solicitante."""
+        self.agregar(row)
+        return self.delta_nueva(row["id"])
+
+    def delta_nueva(self, solicitud_id: int) -> dict | None:
+        """Delta `nueva` de una solicitud ya agregada (None si el evento se
+        cerro en el medio).
+
+        Los deltas se crean justo antes de publicarlos, sin awaits en el
+        medio: asi los sockets de /ws/cola de este worker los reciben en
+        orden de version aunque los requests terminen en otro orden (un
+        hueco hace que cola.js reconecte).
+        """
+        row = self.get(solicitud_id)
+        if row is None:
+            return None
+        return self.events[row["evento_id"]].delta("nueva", row=EventQueue.publica(row))
+
+    def set_votos(self, solicitud_id: int, votos: int):
+        """Refleja un conteo ya persistido (ver votos.py); no genera delta."""
+        row = self.get(solicitud_id)
+        self.events[row["evento_id"]].set_votos(solicitud_id, votos)
+
+    def delta_votos(self, solicitud_id: int) -> dict:
+        row = self.get(solicitud_id)
+        return self.events[row["evento_id"]].delta("votos", id=solicitud_id, votos=row["votos"])
+
+    def cambiar_estado(self, solicitud_id: int, estado: str) -> dict:
+        row = self.get(solicitud_id)
+        q = self.events[row["evento_id"]]
+        anterior = row["estado"]
+        q.set_estado(solicitud_id, estado)
+        self._pending_estado[solicitud_id] = estado
+        if estado == "rechazada":
+            return q.delta("eliminada", id=solicitud_id)
+        if anterior == "rechazada":
+            return q.delta("nueva", row=q.publica(row))
+        return q.delta("estado", id=solicitud_id, estado=estado)
+
+    def estados_pendientes(self, evento_id: int) -> list[tuple[str, int]]:
+        """Saca del write-behind los cambios de estado del evento, para
+        escribirlos en otra transaccion (al cerrarlo)."""
+        ids = [sid for sid in self._pending_estado if self.evento_de.get(sid) == evento_id]
+        return [(self._pending_estado.pop(sid), sid) for sid in ids]
+
+    def descartar(self, evento_id: int) -> list[int]:
+        """Saca un evento cerrado de memoria. Devuelve los ids que tenia."""
+        q = self.events.pop(evento_id, None)
+        if q is None:
+            return []
+        for sid in q.rows:
+            self.evento_de.pop(sid, None)
+            self._pending_estado.pop(sid, None)
+        return list(q.rows)
+
+    # ─── Persistencia ─────────────────────────────────────────────────
+    async def flush(self):
+        if not self._pending_estado:
+            return
+        estados, self._pending_estado = self._pending_estado, {}
+        try:
+            async with db.write() as conn:
+                await conn.executemany(
+                    "UPDATE solicitudes SET estado=? WHERE id=?",
+                    [(e, sid) for sid, e in estados.items()]
+                )
+        except:
+            # Reencolar para el siguiente ciclo sin pisar cambios mas nuevos
+            for sid, e in estados.items():
+                self._pending_estado.setdefault(sid, e)
+            raise
+
+    def sin_guardar(self) -> int:
+        return len(self._pending_estado)
+
+    async def _flush_loop(self):
+        while True:
+            espera = self.flush_interval * 2 ** min(self.fallos, 10)
+            await asyncio.sleep(min(espera, QUEUE_FLUSH_MAX_MS / 1000))
+            try:
+                await self.flush()
+            except Exception:
+                ERRORES_FONDO.inc("queue_flush")
+                self.fallos += 1
+                if self.fallos == 1:
+                    log.exception("flush de estados fallido, se reintenta")
+                elif self.fallos % 10 == 0:
+                    log.error("flush de estados sigue fallando (%d intentos), %d cambios sin guardar",
+                              self.fallos, self.sin_guardar())
+                continue
+            if self.fallos:
+                log.warning("flush de estados recuperado despues de %d intentos", self.fallos)
+                self.fallos = 0
+
+    async def start(self):
+        await self.load()
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+colas = QueueState()
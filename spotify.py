@@ -1,9 +1,60 @@
+import asyncio
+import importlib.util
+import os
+import time
+from collections import OrderedDict
+
 import httpx
 
-async def buscar_canciones(query: str, limit: int = 8) -> list:
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            "https://itunes.apple.com/search",
+from catalogo import CatalogBackend, importar_solicitudes
+from limites import LimiteExcedido, TokenBucket
+from metricas import BUSQUEDA_ERRORES, BUSQUEDA_LATENCIA
+
+ITUNES_URL = os.getenv("ITUNES_URL", "https://itunes.apple.com/search")
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "600"))
+# Llamadas por segundo a iTunes (y rafaga maxima)
+SEARCH_RATE = float(os.getenv("SEARCH_RATE", "5"))
+SEARCH_BURST = int(os.getenv("SEARCH_BURST", "10"))
+# Espera maxima por un token; con mas demanda se responde sin ir a iTunes
+SEARCH_MAX_WAIT = float(os.getenv("SEARCH_MAX_WAIT", "1"))
+# itunes | local (solo catalogo offline) | hibrido (catalogo + iTunes si hay red)
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "itunes")
+HYBRID_TIMEOUT = float(os.getenv("HYBRID_TIMEOUT", "1.5"))
+
+def normalizar(query: str) -> str:
+    return " ".join(query.casefold().split())
+
+# ─── Backends ─────────────────────────────────────────────────────────
+class ITunesBackend:
+    """Busqueda en la API de iTunes con un solo cliente HTTP reutilizado.
+
+    Cada llamada consume un token del bucket para no pasarse del rate limit
+    de Apple. Si el token tardaria mas de SEARCH_MAX_WAIT se lanza
+    LimiteExcedido en vez de encolar la busqueda.
+    """
+
+    def __init__(self, url: str = ITUNES_URL, rate: float = SEARCH_RATE, burst: int = SEARCH_BURST,
+                 max_espera: float = SEARCH_MAX_WAIT):
+        self.url = url
+        self.bucket = TokenBucket(rate, burst)
+        self.max_espera = max_espera
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=importlib.util.find_spec("h2") is not None,
+                timeout=httpx.Timeout(5.0, connect=3.0),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            )
+        return self._client
+
+    async def buscar(self, query: str, limit: int) -> list:
+        await self.bucket.acquire(self.max_espera)
+        response = await self.client.get(
+            self.url,
             params={
                 "term": query,
                 "media": "music",
@@ -11,17 +62,143 @@ async def buscar_canciones(query: str, limit: int = 8) -> list:
                 "country": "US"
             }
         )
+        response.raise_for_status()
         data = response.json()
 
-    resultados = []
-    for track in data.get("results", []):
-        resultados.append({
-            "spotify_id": str(track["trackId"]),
-            "cancion": track["trackName"],
-            "artista": track["artistName"],
-            "album": track.get("collectionName", ""),
-            "portada_url": track["artworkUrl100"].replace("100x100", "300x300"),
-            "preview_url": track.get("previewUrl"),
-            "duracion_ms": track.get("trackTimeMillis", 0)
-        })
-    return resultados
+        resultados = []
+        for track in data.get("results", []):
+            resultados.append({
+                "spotify_id": str(track["trackId"]),
+                "cancion": track["trackName"],
+                "artista": track["artistName"],
+                "album": track.get("collectionName", ""),
+                "portada_url": track["artworkUrl100"].replace("100x100", "300x300"),
+                "preview_url": track.get("previewUrl"),
+                "duracion_ms": track.get("trackTimeMillis", 0)
+            })
+        return resultados
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+class HybridBackend:
+    """Catalogo local primero; si no alcanza, completa con iTunes.
+
+    Sin red (o si iTunes tarda mas de HYBRID_TIMEOUT) devuelve solo lo local.
+    Los resultados remotos se guardan en el catalogo para la proxima vez.
+    """
+
+    def __init__(self, local: CatalogBackend, remoto: ITunesBackend, timeout: float = HYBRID_TIMEOUT):
+        self.local = local
+        self.remoto = remoto
+        self.timeout = timeout
+
+    async def buscar(self, query: str, limit: int) -> list:
+        locales = await self.local.buscar(query, limit)
+        if len(locales) >= limit:
+            return locales
+        try:
+            remotos = await asyncio.wait_for(self.remoto.buscar(query, limit), self.timeout)
+        except Exception:
+            return locales
+        await self.local.guardar(remotos)
+        vistos = {r["spotify_id"] for r in locales}
+        return (locales + [r for r in remotos if r["spotify_id"] not in vistos])[:limit]
+
+    async def aclose(self):
+        await self.local.aclose()
+        await self.remoto.aclose()
+
+def crear_backend(nombre: str = SEARCH_BACKEND):
+    if nombre == "local":
+        return CatalogBackend()
+    if nombre == "hibrido":
+        return HybridBackend(CatalogBackend(), ITunesBackend())
+    return ITunesBackend()
+
+# ─── Servicio de busqueda ─────────────────────────────────────────────
+class SearchService:
+    """Cache LRU+TTL y fusion de busquedas identicas en vuelo.
+
+    Veinte invitados escribiendo "bad bunny" al mismo tiempo producen una
+    sola llamada a iTunes; las siguientes salen del cache hasta que vence.
+    Si el backend falla o esta al limite y hay un resultado vencido, se
+    devuelve ese.
+    """
+
+    def __init__(self, backend=None, cache_size: int = SEARCH_CACHE_SIZE, ttl: float = SEARCH_CACHE_TTL):
+        self.backend = backend or crear_backend()
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self._cache: OrderedDict[tuple, tuple[float, list]] = OrderedDict()
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get_cached(self, key: tuple, allow_stale: bool = False) -> list | None:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires, resultados = entry
+        if expires < time.monotonic() and not allow_stale:
+            return None
+        self._cache.move_to_end(key)
+        return resultados
+
+    def _put(self, key: tuple, resultados: list):
+        self._cache[key] = (time.monotonic() + self.ttl, resultados)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _fetch(self, key: tuple, query: str, limit: int) -> list:
+        backend = type(self.backend).__name__
+        t0 = time.perf_counter()
+        try:
+            resultados = await self.backend.buscar(query, limit)
+        except Exception as e:
+            if not isinstance(e, LimiteExcedido):
+                BUSQUEDA_ERRORES.inc(backend)
+            stale = self._get_cached(key, allow_stale=True)
+            if stale is not None:
+                return stale
+            raise
+        BUSQUEDA_LATENCIA.observar(time.perf_counter() - t0, backend)
+        self._put(key, resultados)
+        return resultados
+
+    async def buscar(self, query: str, limit: int = 8) -> list:
+        q = normalizar(query)
+        if not q:
+            return []
+        key = (q, limit)
+        cached = self._get_cached(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(self._fetch(key, q, limit))
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: si un cliente cancela, la busqueda sigue para los demas
+        return await asyncio.shield(fut)
+
+    async def aclose(self):
+        await self.backend.aclose()
+
+servicio = SearchService()
+
+async def buscar_canciones(query: str, limit: int = 8) -> list:
+    return await servicio.buscar(query, limit)
+
+async def sincronizar_catalogo(db_path: str) -> int:
+    """Carga el historial de solicitudes en el catalogo local, si se usa uno."""
+    backend = servicio.backend
+    local = backend.local if isinstance(backend, HybridBackend) else backend
+    if not isinstance(local, CatalogBackend):
+        return 0
+    return await importar_solicitudes(local, db_path)
@@ -0,0 +1,45 @@
+// Cola en vivo: snapshot + deltas versionados por /ws/cola/{evento_id}.
+// onChange recibe la cola completa (array ordenado por votos DESC, id ASC)
+// cada vez que cambia. Al reconectar se manda ?desde=<version> para recibir
+// solo los cambios perdidos.
+function suscribirCola(eventoId, onChange) {
+  const items = new Map();
+  let version = null;
+  let origen = null;  // worker que emitio las versiones
+  let ws = null;
+
+  function emit() {
+    const lista = [...items.values()].sort((a, b) => (b.votos - a.votos) || (a.id - b.id));
+    onChange(lista);
+  }
+
+  function aplicar(msg) {
+    if (msg.tipo === 'cola_snapshot') {
+      items.clear();
+      msg.cola.forEach(r => items.set(r.id, r));
+      version = msg.v;
+      origen = msg.o;
+      emit();
+      return;
+    }
+    if (msg.tipo !== 'cola_delta' || version === null || msg.v <= version) return;
+    if (msg.v !== version + 1) { ws.close(); return; }  // hueco: reconectar y resincronizar
+    version = msg.v;
+    if (msg.op === 'nueva') items.set(msg.row.id, msg.row);
+    else if (msg.op === 'eliminada') items.delete(msg.id);
+    else if (msg.op === 'votos' && items.has(msg.id)) items.get(msg.id).votos = msg.votos;
+    else if (msg.op === 'estado' && items.has(msg.id)) items.get(msg.id).estado = msg.estado;
+    else if (msg.op === 'dedicatoria' && items.has(msg.id)) items.get(msg.id).dedicatoria = msg.dedicatoria;
+    emit();
+  }
+
+  function conectar() {
+    const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const qs = version === null ? '' : '?desde=' + version + '&o=' + encodeURIComponent(origen);
+    ws = new WebSocket(protocol + '//' + location.host + '/ws/cola/' + eventoId + qs);
+    ws.onmessage = (e) => aplicar(JSON.parse(e.data));
+    ws.onclose = () => setTimeout(conectar, 3000);
+  }
+
+  conectar();
+}
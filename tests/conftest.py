@@ -0,0 +1,51 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+RAIZ = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ))
+# main monta static/ y templates/ con rutas relativas
+os.chdir(RAIZ)
+
+# Antes de importar los modulos de la app: leen la configuracion al importarse
+TMP = tempfile.mkdtemp(prefix="djreq_tests_")
+os.environ["DB_PATH"] = os.path.join(TMP, "dj_request.db")
+os.environ["BUS_PATH"] = os.path.join(TMP, "bus.db")
+os.environ["CATALOG_PATH"] = os.path.join(TMP, "catalogo.db")
+os.environ["TRUST_PROXY"] = "1"
+os.environ["BUS_BACKEND"] = "local"
+os.environ["SEARCH_BACKEND"] = "itunes"
+os.environ.pop("RATE_LIMITS", None)
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+async def falso():
+    from itunes_falso import ITunesFalso
+    async with ITunesFalso() as f:
+        yield f
+
+@pytest.fixture
+async def cliente():
+    """La app completa (startup/shutdown) sobre una base vacia."""
+    import httpx
+    import main
+    from limites import limitador
+
+    for sufijo in ("", "-wal", "-shm"):
+        try:
+            os.unlink(os.environ["DB_PATH"] + sufijo)
+        except FileNotFoundError:
+            pass
+    limitador._buckets.clear()
+    await main.startup()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as c:
+            yield c
+    finally:
+        await main.shutdown()
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+import main
+from main import DJ_PASSWORD
+from votos import votaciones
+
+pytestmark = pytest.mark.anyio
+
+def ip(n) -> dict:
+    return {"x-forwarded-for": f"10.2.0.{n}"}
+
+async def pedir(cliente, n, spotify_id="s1", **extra):
+    return await cliente.post("/api/solicitar", headers=ip(n),
+                              json={"cancion": "Tusa", "artista": "Karol G", "spotify_id": spotify_id, **extra})
+
+async def test_un_voto_por_ip(cliente):
+    sid = (await pedir(cliente, 1)).json()["id"]
+    # El solicitante ya cuenta como votante
+    assert (await cliente.post(f"/api/votar/{sid}", headers=ip(1))).status_code == 409
+    r = await asyncio.gather(*(cliente.post(f"/api/votar/{sid}", headers=ip(2)) for _ in range(5)))
+    assert sorted(x.status_code for x in r) == [200, 409, 409, 409, 409]
+    assert (await cliente.post(f"/api/votar/{sid}", headers=ip(3))).json() == {"votos": 3}
+    assert (await cliente.post("/api/votar/999", headers=ip(3))).status_code == 404
+    async with main.db.read() as conn:
+        cursor = await conn.execute("SELECT votos, (SELECT COUNT(*) FROM votos) FROM solicitudes WHERE id=?", (sid,))
+        assert tuple(await cursor.fetchone()) == (3, 3)
+
+async def test_pedidos_repetidos_se_fusionan(cliente):
+    r = await asyncio.gather(*(pedir(cliente, n, dedicatoria=f"para {n}") for n in range(1, 4)))
+    assert len({x.json()["id"] for x in r}) == 1
+    assert sum(bool(x.json().get("fusionada")) for x in r) == 2
+    cola = (await cliente.get("/api/cola/1")).json()
+    assert len(cola) == 1 and cola[0]["votos"] == 3
+    assert cola[0]["dedicatoria"] == "para 1 · para 2 · para 3"
+    assert "ip_solicitante" not in cola[0]
+
+async def test_votos_y_fusiones_en_el_mismo_lote_que_un_cierre(cliente):
+    sid = (await pedir(cliente, 1)).json()["id"]
+    cierre, voto, fusion = await asyncio.gather(
+        main.cerrar_y_abrir(1, "Siguiente"),
+        cliente.post(f"/api/votar/{sid}", headers=ip(2)),
+        pedir(cliente, 3, dedicatoria="hola"),
+    )
+    assert cierre["cerrados"][0]["archivadas"] == 1
+    assert voto.status_code == 404
+    assert fusion.status_code == 409
+    assert not votaciones.ya_voto(sid, "10.2.0.2")
+
+async def test_cerrar_evento_archiva_y_abre_otro(cliente):
+    await pedir(cliente, 1)
+    r = await cliente.post("/api/dj/eventos/1/cerrar", json={"password": DJ_PASSWORD, "nuevo": "Otra"})
+    assert r.status_code == 200 and r.json()["archivadas"] == 1
+    nuevo = r.json()["nuevo_id"]
+    assert (await cliente.get("/api/cola/1")).json() == []
+    assert (await pedir(cliente, 2, evento_id=1)).status_code == 409
+    assert (await pedir(cliente, 2, evento_id=nuevo)).status_code == 200
+    eventos = (await cliente.get("/api/dj/eventos", params={"password": DJ_PASSWORD})).json()["eventos"]
+    assert [(e["id"], e["activo"]) for e in eventos] == [(1, 0), (nuevo, 1)]
+
+async def test_rate_limit_por_ip_solo_si_se_configura(cliente, monkeypatch):
+    from limites import limitador
+
+    # Por defecto apagado: un salon detras de NAT comparte la IP
+    assert limitador.limites == {}
+    r = await asyncio.gather(*(pedir(cliente, 1, spotify_id=f"s{n}") for n in range(5)))
+    assert {x.status_code for x in r} == {200}
+    monkeypatch.setattr(limitador, "limites", {"solicitar": (0.1, 1)})
+    assert (await pedir(cliente, 2, spotify_id="a")).status_code == 200
+    limite = await pedir(cliente, 2, spotify_id="b")
+    assert limite.status_code == 429 and limite.headers["retry-after"] == "10"
+    assert (await pedir(cliente, 3, spotify_id="c")).status_code == 200
@@ -0,0 +1,107 @@
+import asyncio
+
+import httpx
+import pytest
+
+import spotify
+from limites import LimiteExcedido
+from spotify import ITunesBackend, SearchService
+
+pytestmark = pytest.mark.anyio
+
+async def test_backend_parsea_la_respuesta_de_itunes(falso):
+    backend = ITunesBackend(falso.url)
+    try:
+        resultados = await backend.buscar("bad bunny", 3)
+    finally:
+        await backend.aclose()
+    assert falso.llamadas == 1
+    assert [r["cancion"] for r in resultados] == ["Bad Bunny 0", "Bad Bunny 1", "Bad Bunny 2"]
+    assert resultados[0]["artista"] == "Bad Bunny"
+    assert resultados[0]["portada_url"].endswith("300x300bb.jpg")
+    assert set(resultados[0]) == {"spotify_id", "cancion", "artista", "album", "portada_url",
+                                  "preview_url", "duracion_ms"}
+
+async def test_backend_lanza_si_itunes_falla(falso):
+    falso.fallar = True
+    backend = ITunesBackend(falso.url)
+    try:
+        with pytest.raises(httpx.HTTPStatusError):
+            await backend.buscar("queen", 3)
+    finally:
+        await backend.aclose()
+
+async def test_cache_normaliza_la_busqueda(falso):
+    servicio = SearchService(ITunesBackend(falso.url), ttl=60)
+    try:
+        primera = await servicio.buscar("Bad  Bunny")
+        segunda = await servicio.buscar("bad bunny")
+    finally:
+        await servicio.aclose()
+    assert primera == segunda
+    assert falso.llamadas == 1
+    assert (servicio.hits, servicio.misses) == (1, 1)
+
+async def test_busquedas_identicas_en_vuelo_hacen_una_llamada(falso):
+    falso.demora = 0.1
+    servicio = SearchService(ITunesBackend(falso.url), ttl=60)
+    try:
+        resultados = await asyncio.gather(*(servicio.buscar("shakira") for _ in range(20)))
+    finally:
+        await servicio.aclose()
+    assert falso.llamadas == 1
+    assert all(r == resultados[0] for r in resultados)
+
+async def test_cancelar_una_busqueda_no_corta_a_las_demas(falso):
+    falso.demora = 0.1
+    servicio = SearchService(ITunesBackend(falso.url), ttl=60)
+    try:
+        cancelada = asyncio.ensure_future(servicio.buscar("abba"))
+        otra = asyncio.ensure_future(servicio.buscar("abba"))
+        await asyncio.sleep(0.02)
+        cancelada.cancel()
+        assert len(await otra) == 8
+    finally:
+        await servicio.aclose()
+    assert falso.llamadas == 1
+
+async def test_resultado_vencido_si_itunes_falla(falso):
+    servicio = SearchService(ITunesBackend(falso.url), ttl=0)
+    try:
+        viejo = await servicio.buscar("selena")
+        falso.fallar = True
+        assert await servicio.buscar("selena") == viejo
+        with pytest.raises(httpx.HTTPStatusError):
+            await servicio.buscar("maluma")
+    finally:
+        await servicio.aclose()
+    assert falso.llamadas == 3
+
+async def test_al_limite_no_espera_el_token(falso):
+    servicio = SearchService(ITunesBackend(falso.url, rate=0.5, burst=1, max_espera=0.1), ttl=0)
+    try:
+        viejo = await servicio.buscar("karol g")
+        # Sin token: devuelve lo vencido sin llamar a iTunes
+        assert await servicio.buscar("karol g") == viejo
+        with pytest.raises(LimiteExcedido) as e:
+            await servicio.buscar("daddy yankee")
+    finally:
+        await servicio.aclose()
+    assert falso.llamadas == 1
+    assert 1.5 < e.value.espera <= 2
+
+async def test_api_buscar_responde_429_al_limite(falso, monkeypatch):
+    import main
+
+    servicio = SearchService(ITunesBackend(falso.url, rate=0.5, burst=1, max_espera=0), ttl=60)
+    monkeypatch.setattr(spotify, "servicio", servicio)
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as c:
+            ok = await c.get("/api/buscar", params={"q": "the weeknd"}, headers={"x-forwarded-for": "10.1.0.1"})
+            limite = await c.get("/api/buscar", params={"q": "dua lipa"}, headers={"x-forwarded-for": "10.1.0.2"})
+    finally:
+        await servicio.aclose()
+    assert ok.status_code == 200 and len(ok.json()) == 8
+    assert limite.status_code == 429
+    assert limite.headers["retry-after"] == "2"
+    assert falso.llamadas == 1
@@ -0,0 +1,76 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from database import Database
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def base(tmp_path):
+    # Como init_db: el archivo ya existe en WAL antes de abrir el pool
+    path = str(tmp_path / "lote.db")
+    con = sqlite3.connect(path)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("CREATE TABLE t (x INTEGER)")
+    con.close()
+    db = Database(path, readers=2)
+    await db.open()
+    yield db
+    await db.close()
+
+def insertar(x):
+    async def op(conn, lote):
+        await conn.execute("INSERT INTO t (x) VALUES (?)", (x,))
+        lote.setdefault("ops", []).append(x)
+        return len(lote["ops"])
+    return op
+
+async def valores(db) -> list[int]:
+    async with db.read() as conn:
+        cursor = await conn.execute("SELECT x FROM t ORDER BY x")
+        return [r[0] for r in await cursor.fetchall()]
+
+async def test_escrituras_concurrentes_van_en_un_lote(base):
+    posiciones = await asyncio.gather(*(base.en_lote(insertar(x)) for x in range(10)))
+    # Todas vieron el mismo dict `lote`: una sola transaccion
+    assert sorted(posiciones) == list(range(1, 11))
+    assert await valores(base) == list(range(10))
+
+async def test_una_operacion_que_falla_no_tira_el_lote(base):
+    async def falla(conn, lote):
+        await conn.execute("INSERT INTO t (x) VALUES (2)")
+        raise ValueError("no")
+
+    r = await asyncio.gather(base.en_lote(insertar(1)), base.en_lote(falla), base.en_lote(insertar(3)),
+                             return_exceptions=True)
+    assert r[0] == 1 and isinstance(r[1], ValueError) and r[2] == 2
+    assert await valores(base) == [1, 3]
+
+async def test_aplicar_corre_despues_del_commit_y_en_orden(base):
+    vistos, orden = [], []
+
+    def aplicar(x):
+        def f(r):
+            # Otra conexion ya ve la fila: el commit se hizo antes
+            con = sqlite3.connect(base.path)
+            vistos.append(con.execute("SELECT COUNT(*) FROM t WHERE x=?", (x,)).fetchone()[0])
+            con.close()
+            orden.append(x)
+            return x * 10
+        return f
+
+    r = await asyncio.gather(*(base.en_lote(insertar(x), aplicar(x)) for x in range(5)))
+    assert r == [0, 10, 20, 30, 40]
+    assert orden == list(range(5))
+    assert vistos == [1] * 5
+
+async def test_close_aplica_lo_encolado(base):
+    pendientes = [asyncio.ensure_future(base.en_lote(insertar(x))) for x in range(3)]
+    await asyncio.sleep(0)
+    await base.close()
+    assert [p.result() for p in pendientes] == [1, 2, 3]
+    con = sqlite3.connect(base.path)
+    assert con.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 3
+    con.close()
@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+import pytest
+
+from limites import LimiteExcedido, RateLimiter, TokenBucket, parsear_limites
+
+def test_parsear_limites():
+    assert parsear_limites("solicitar=0.2/3, votar=2/10,buscar=1") == {
+        "solicitar": (0.2, 3), "votar": (2.0, 10), "buscar": (1.0, 1)}
+    assert parsear_limites("") == {}
+
+def test_intentar_consume_la_rafaga_y_devuelve_la_espera():
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.intentar() for _ in range(3)] == [0, 0, 0]
+    assert bucket.intentar() == pytest.approx(0.5, abs=0.05)
+
+def test_limitador_por_ip_y_ruta():
+    limitador = RateLimiter({"solicitar": (0.1, 2)})
+    assert limitador.permitir("1.1.1.1", "solicitar") == 0
+    assert limitador.permitir("1.1.1.1", "solicitar") == 0
+    assert limitador.permitir("1.1.1.1", "solicitar") > 0
+    assert limitador.permitir("2.2.2.2", "solicitar") == 0
+    # Ruta sin limite configurado
+    assert all(limitador.permitir("1.1.1.1", "votar") == 0 for _ in range(50))
+
+def test_limitador_descarta_las_ips_menos_usadas():
+    limitador = RateLimiter({"votar": (0.1, 1)}, maxsize=2)
+    for ip in ("a", "b", "c"):
+        limitador.permitir(ip, "votar")
+    assert list(limitador._buckets) == [("b", "votar"), ("c", "votar")]
+    # "a" vuelve con un bucket nuevo y lleno
+    assert limitador.permitir("a", "votar") == 0
+
+@pytest.mark.anyio
+async def test_acquire_reserva_turnos():
+    bucket = TokenBucket(rate=20, burst=1)
+    t0 = time.monotonic()
+    await asyncio.gather(*(bucket.acquire() for _ in range(4)))
+    # 1 de la rafaga + 3 turnos de 50 ms, sin esperas repetidas
+    assert 0.13 < time.monotonic() - t0 < 0.3
+
+@pytest.mark.anyio
+async def test_acquire_con_espera_maxima_no_reserva():
+    bucket = TokenBucket(rate=1, burst=1)
+    await bucket.acquire(max_espera=0)
+    with pytest.raises(LimiteExcedido) as e:
+        await bucket.acquire(max_espera=0.5)
+    assert e.value.espera == pytest.approx(1, abs=0.05)
+    # El intento rechazado no dejo tokens negativos
+    assert bucket.tokens >= 0
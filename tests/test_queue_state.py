@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from bus import ORIGEN
+from metricas import ERRORES_FONDO
+from queue_state import QueueState
+
+def fila(id, votos=1, estado="pendiente", spotify_id="", evento_id=1, **extra):
+    return {"id": id, "evento_id": evento_id, "cancion": f"C{id}", "artista": "A", "spotify_id": spotify_id,
+            "portada_url": "", "dedicatoria": "", "votos": votos, "estado": estado, "tipo": "cancion",
+            "ip_solicitante": f"10.0.0.{id}", "creado_en": "2026-01-01 00:00:00", **extra}
+
+def cola_con(*filas) -> QueueState:
+    colas = QueueState()
+    for f in filas:
+        colas.agregar(f)
+    return colas
+
+def ids(cola: list[dict]) -> list[int]:
+    return [r["id"] for r in cola]
+
+def test_orden_por_votos_y_llegada():
+    colas = cola_con(fila(1, votos=1), fila(2, votos=3), fila(3, votos=3), fila(4, votos=2))
+    assert ids(colas.cola(1)) == [2, 3, 4, 1]
+    assert ids(colas.cola(1, offset=1, limit=2)) == [3, 4]
+    colas.set_votos(1, 5)
+    assert ids(colas.cola(1)) == [1, 2, 3, 4]
+
+def test_rechazadas_salen_de_la_cola_y_pueden_volver():
+    colas = cola_con(fila(1), fila(2, votos=2))
+    assert colas.cambiar_estado(2, "rechazada")["op"] == "eliminada"
+    assert ids(colas.cola(1)) == [1]
+    assert colas.cambiar_estado(2, "aprobada")["op"] == "nueva"
+    assert ids(colas.cola(1)) == [2, 1]
+    assert colas.estados_pendientes(1) == [("aprobada", 2)]
+
+def test_cola_publica_sin_ip():
+    colas = QueueState()
+    delta = colas.nueva(fila(1))
+    assert "ip_solicitante" not in delta["row"]
+    assert all("ip_solicitante" not in r for r in colas.cola(1))
+    assert all("ip_solicitante" not in r for r in colas.resync(1)[0]["cola"])
+    # El panel la pide explicitamente
+    assert colas.listar(1, ("id", "ip_solicitante"))["solicitudes"] == [{"id": 1, "ip_solicitante": "10.0.0.1"}]
+
+def test_lecturas_de_un_evento_desconocido_no_crean_colas():
+    colas = cola_con(fila(1))
+    assert colas.cola(99) == []
+    assert colas.listar(99)["solicitudes"] == []
+    assert colas.resync(99) == [{"tipo": "cola_snapshot", "v": 0, "o": ORIGEN, "cola": []}]
+    assert list(colas.events) == [1]
+
+def test_resync_desde_una_version():
+    colas = cola_con(fila(1))
+    v = colas.events[1].version
+    d1 = colas.nueva(fila(2))
+    colas.set_votos(1, 4)
+    d2 = colas.delta_votos(1)
+    assert [d1["v"], d2["v"]] == [v + 1, v + 2]
+    assert colas.resync(1, v, ORIGEN) == [d1, d2]
+    assert colas.resync(1, v + 2, ORIGEN) == []
+    # Otro worker: snapshot completo
+    assert colas.resync(1, v, "otro")[0]["tipo"] == "cola_snapshot"
+
+def test_listar_pagina_con_cursor_y_filtra():
+    colas = cola_con(*(fila(i, estado="aprobada" if i % 2 else "pendiente") for i in range(1, 8)))
+    pagina = colas.listar(1, cursor=0, limit=3)
+    assert ids(pagina["solicitudes"]) == [1, 2, 3] and pagina["cursor"] == 3
+    pagina = colas.listar(1, cursor=pagina["cursor"], limit=3)
+    assert ids(pagina["solicitudes"]) == [4, 5, 6] and pagina["cursor"] == 6
+    pagina = colas.listar(1, cursor=6, limit=3)
+    assert ids(pagina["solicitudes"]) == [7] and pagina["cursor"] is None
+    assert ids(colas.listar(1, estados={"aprobada"})["solicitudes"]) == [1, 3, 5, 7]
+
+def test_listar_solo_cambios_desde_una_version():
+    colas = cola_con(fila(1), fila(2), fila(3))
+    v = colas.listar(1)["v"]
+    colas.cambiar_estado(2, "aprobada")
+    cambios = colas.listar(1, desde=v, origen=ORIGEN)
+    assert ids(cambios["solicitudes"]) == [2] and not cambios["completo"]
+    assert colas.listar(1, desde=v, origen="otro")["completo"]
+
+def test_duplicado_sigue_a_la_solicitud_activa():
+    colas = cola_con(fila(1, spotify_id="s"), fila(2, spotify_id="s"))
+    assert colas.duplicado(1, "s")["id"] == 1
+    colas.cambiar_estado(1, "reproducida")
+    assert colas.duplicado(1, "s")["id"] == 2
+    colas.cambiar_estado(2, "rechazada")
+    assert colas.duplicado(1, "s") is None
+    assert colas.duplicado(2, "s") is None
+
+def test_descartar_un_evento_cerrado():
+    colas = cola_con(fila(1), fila(2, evento_id=2))
+    colas.cambiar_estado(1, "aprobada")
+    assert colas.descartar(1) == [1]
+    assert colas.get(1) is None and colas.get(2) is not None
+    assert colas.estados_pendientes(1) == []
+
+@pytest.mark.anyio
+async def test_flush_fallido_se_reintenta_y_se_reporta(caplog):
+    colas = cola_con(fila(1))
+    colas.flush_interval = 0.001
+    colas.cambiar_estado(1, "aprobada")
+    intentos = []
+
+    async def flush():
+        intentos.append(colas.sin_guardar())
+        if len(intentos) <= 3:
+            raise RuntimeError("disco lleno")
+        colas._pending_estado.clear()
+
+    colas.flush = flush
+    antes = ERRORES_FONDO.valores.get(("queue_flush",), 0)
+    tarea = asyncio.create_task(colas._flush_loop())
+    while len(intentos) < 4:
+        await asyncio.sleep(0.001)
+    await asyncio.sleep(0.01)
+    tarea.cancel()
+    # El cambio sigue pendiente en cada reintento hasta que se guarda
+    assert intentos[:4] == [1, 1, 1, 1] and not any(intentos[4:])
+    assert colas.fallos == 0 and colas.sin_guardar() == 0
+    assert ERRORES_FONDO.valores[("queue_flush",)] - antes == 3
+    mensajes = [r.getMessage() for r in caplog.records if r.name == "queue_state"]
+    assert mensajes == ["flush de estados fallido, se reintenta",
+                        "flush de estados recuperado despues de 3 intentos"]
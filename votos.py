@@ -0,0 +1,115 @@
+import asyncio
+import os
+
+from fastapi import HTTPException
+
+from connections import manager
+from database import db
+from queue_state import colas
+
+# Ventana para agrupar los broadcasts de votos de una misma solicitud
+VOTE_COALESCE_MS = int(os.getenv("VOTE_COALESCE_MS", "250"))
+
+class VoteEngine:
+    """Un voto por IP y solicitud, registrado en la tabla `votos`.
+
+    Los votos repetidos se rechazan en memoria sin tocar SQLite. Un voto
+    nuevo inserta en `votos` y actualiza el contador en la misma
+    transaccion (agrupada con otras, ver Database.en_lote); el
+    UPDATE ... RETURNING devuelve el conteo nuevo.
+    Los broadcasts se agrupan: como maximo un mensaje por solicitud cada
+    VOTE_COALESCE_MS, con el ultimo conteo.
+    """
+
+    def __init__(self, window_ms: int = VOTE_COALESCE_MS):
+        self.votantes: dict[int, set[str]] = {}
+        self.window = window_ms / 1000
+        self._pendientes: set[int] = set()
+        self._timer: asyncio.TimerHandle | None = None
+
+    async def load(self):
+        self.votantes.clear()
+        async with db.read() as conn:
+            cursor = await conn.execute("SELECT solicitud_id, ip_votante FROM votos")
+            for solicitud_id, ip in await cursor.fetchall():
+                self.votantes.setdefault(solicitud_id, set()).add(ip)
+
+    def registrar(self, solicitud_id: int, ip: str):
+        """Marca al solicitante como votante de su propia solicitud."""
+        self.votantes.setdefault(solicitud_id, set()).add(ip)
+
+    def descartar(self, ids: list[int]):
+        """Olvida los votantes de solicitudes archivadas."""
+        for solicitud_id in ids:
+            self.votantes.pop(solicitud_id, None)
+            self._pendientes.discard(solicitud_id)
+
+    def ya_voto(self, solicitud_id: int, ip: str) -> bool:
+        return ip in self.votantes.get(solicitud_id, ())
+
+    async def votar(self, solicitud_id: int, ip: str) -> int | None:
+        """Devuelve el conteo nuevo, o None si esa IP ya habia votado."""
+        if self.ya_voto(solicitud_id, ip):
+            return None
+        # Marcar antes de esperar a SQLite: un doble tap concurrente no pasa
+        votantes = self.votantes.setdefault(solicitud_id, set())
+        votantes.add(ip)
+        try:
+            return await db.en_lote(
+                lambda conn, lote: self.sumar(conn, solicitud_id, ip),
+                lambda votos: self.confirmar(solicitud_id, ip, votos),
+            )
+        except:
+            votantes.discard(ip)
+            raise
+
+    async def sumar(self, conn, solicitud_id: int, ip: str) -> int | None:
+        """SQL del voto dentro de una transaccion ya abierta. None si repetido,
+        404 si la solicitud ya no esta (archivada antes en el mismo lote)."""
+        cursor = await conn.execute(
+            "INSERT OR IGNORE INTO votos (solicitud_id, ip_votante) VALUES (?,?)",
+            (solicitud_id, ip)
+        )
+        if cursor.rowcount == 0:
+            return None
+        cursor = await conn.execute(
+            "UPDATE solicitudes SET votos=votos+1 WHERE id=? RETURNING votos",
+            (solicitud_id,)
+        )
+        row = await cursor.fetchone()
+        if row is None:
+            # El savepoint de la operacion deshace el INSERT en votos
+            raise HTTPException(404, "Not found")
+        return row[0]
+
+    def confirmar(self, solicitud_id: int, ip: str, votos: int | None) -> int | None:
+        """Refleja en memoria un voto ya commiteado y programa su broadcast."""
+        self.votantes.setdefault(solicitud_id, set()).add(ip)
+        if votos is not None:
+            colas.set_votos(solicitud_id, votos)
+            self._programar(solicitud_id)
+        return votos
+
+    # ─── Broadcast agrupado ───────────────────────────────────────────
+    def _programar(self, solicitud_id: int):
+        self._pendientes.add(solicitud_id)
+        if self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.window, lambda: asyncio.ensure_future(self._emitir()))
+
+    async def _emitir(self):
+        self._timer = None
+        pendientes, self._pendientes = self._pendientes, set()
+        for solicitud_id in pendientes:
+            row = colas.get(solicitud_id)
+            if row is None:
+                continue
+            await manager.broadcast_to_dj({"tipo": "voto", "id": solicitud_id, "votos": row["votos"]})
+            await manager.broadcast_to_cola(row["evento_id"], colas.delta_votos(solicitud_id))
+
+    async def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            await self._emitir()
+
+votaciones = VoteEngine()